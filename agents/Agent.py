@@ -2,7 +2,7 @@ import abc
 import numpy as np
 from mygym.HistoricalOrderbookEnvironment import HistoricalOrderbookEnvironment
 from mygym.utils import done_inf, plot_per_episode, plot_final, info_eval
-from collections import deque
+from agents.ReplayMemories import ReplayMemory, SequenceReplayMemory
 from pylab import plt, mpl
 from copy import deepcopy
 import os
@@ -55,6 +55,7 @@ class Agent(metaclass=abc.ABCMeta):
         self.len_learn = None
         self.len_eval = None
         self.total_steps = 0
+        self.acting_env: HistoricalOrderbookEnvironment = None  # environment of the states given to get_action
 
     def _set_seed_np(self):
         np.random.seed(self.seed)
@@ -68,7 +69,9 @@ class Agent(metaclass=abc.ABCMeta):
             self.epsilon_decay = epsilon_decay  # Decay rate for exploration rate, interval must be a pos function of the nb of xp
             self.gamma = gamma  # Discount factor for delayed reward
             self.batch_size = batch_size  # Batch size for replay
-            self.memory = deque(maxlen=int(10e5))  # deque collection for limited history to train agent
+            # limited history to train agent, lag windows (LSTM states) sharing their rows
+            memory = SequenceReplayMemory if self.learn_env.n_lags_feature > 0 else ReplayMemory
+            self.memory = memory(capacity=int(10e5), seed=self.seed)
             self.test_env.base_threshold = 1
         else:
             self.episodes = 1
@@ -102,10 +105,11 @@ class Agent(metaclass=abc.ABCMeta):
         return self.get_action(state)
 
     def _play_one_step(self, state: np.ndarray):
-        state = state.copy()
         action = self._greedy_policy(state) if self.learning_agent else self.get_action(state)
         next_state, reward, done, info = self.learn_env.step(action)
         if self.learning_agent:
+            # lagged observations are views on the environment lag buffer, overwritten at the next step
+            next_state = next_state.copy()
             self.memory.append(
                 [state, action, reward, next_state, done])
         return next_state, done
@@ -118,9 +122,12 @@ class Agent(metaclass=abc.ABCMeta):
         print(f'****************************************{self.get_name()}****************************************')
         last_ep = self._set_args()
         for episode in range(last_ep, self.episodes + 1):
-            state = self.learn_env.reset(random_time=True)
-            self.len_learn = (self.learn_env.terminal_time - self.learn_env.state.now_is) / self.learn_env.step_size
-            while self.learn_env.end_of_trading >= self.learn_env.state.now_is:
+            state = self.learn_env.reset(random_time=True).copy()
+            self.acting_env = self.learn_env
+            # in agent steps, each holding its action for action_repeat simulator steps
+            self.len_learn = (self.learn_env.terminal_time_ns - self.learn_env.state.now_is) / (
+                self.learn_env.step_size_ns * self.learn_env.action_repeat)
+            while self.learn_env.end_of_trading_ns >= self.learn_env.state.now_is:
                 state, done = self._play_one_step(state)
                 if self.learning_agent and len(self.memory) > self.batch_size and (self.total_steps) % 100 == 0:
                     self.replay()
@@ -156,8 +163,10 @@ class Agent(metaclass=abc.ABCMeta):
         only relies on the exploitation of the currently optimal policy
         """
         state = self.test_env.reset(random_time=False)
-        self.len_eval = (self.test_env.end_of_trading - self.test_env.state.now_is) / self.test_env.step_size
-        while self.test_env.end_of_trading >= self.test_env.state.now_is:
+        self.acting_env = self.test_env
+        self.len_eval = (self.test_env.end_of_trading_ns - self.test_env.state.now_is) / (
+            self.test_env.step_size_ns * self.test_env.action_repeat)
+        while self.test_env.end_of_trading_ns >= self.test_env.state.now_is:
             action = self.get_action(state)
             state, reward, done, info = self.test_env.step(action)
             if done:
@@ -209,6 +218,7 @@ class Agent(metaclass=abc.ABCMeta):
             best_path = path.replace('agents\\savings', 'best_agents').replace('Episode'+ str(episode), '')
             if not os.path.exists(best_path): os.makedirs(best_path)
             self.model.save_args(best_path)
+            self.model.export(best_path)
             print(f'************** Best model yet (max AUM (=PnL) on test set) --> episode {episode} ************** ')
             plot_per_episode(self.learn_env.ticker, self.get_name(),
                              self.learn_env.step_size, self.learn_env.market_order_fraction_of_inventory,
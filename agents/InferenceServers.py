@@ -0,0 +1,126 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from agents.value_approximators.baseline_nets import Net
+
+
+class BatchedInferenceServer:
+    """
+    In-process inference service sharing one model between many environments (vectorised replicas, parallel
+    evaluations, hyperparameter sweeps), each running in its own thread. Environments submit their observation and
+    wait for their greedy action, and a worker thread collects the pending observations into batches: a batch is run
+    as one forward pass (Net.predict_batch) as soon as it holds max_batch_size observations, or max_latency_ms after
+    its first observation arrived, and the actions are scattered back to the waiting environments.
+    Environments stepped in a single thread can call get_actions with all their observations at once instead: they
+    are queued as well while the server is running, so that the model is only ever called from one thread.
+    """
+
+    def __init__(self, net: Net, max_batch_size: int = 64, max_latency_ms: float = 1.0):
+        assert max_batch_size >= 1, "Batches must hold at least one observation."
+        self.net = net
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self.requests: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()  # so that no observation is queued after the worker's stop signal
+        self.worker: threading.Thread = None
+        self.running = False
+        self.n_batches = 0
+        self.n_requests = 0
+
+    def start(self):
+        if self.worker is None:
+            with self.lock:
+                self.running = True
+            self.worker = threading.Thread(target=self._serve, name="BatchedInferenceServer", daemon=True)
+            self.worker.start()
+        return self
+
+    def stop(self):
+        """Serve the pending observations, then stop the worker."""
+        if self.worker is not None:
+            with self.lock:
+                self.running = False
+                self.requests.put(None)
+            self.worker.join()
+            self.worker = None
+            # nothing can be left behind the stop signal, but never leave a client waiting
+            while not self.requests.empty():
+                request = self.requests.get_nowait()
+                if request is not None:
+                    request[1].set_exception(RuntimeError("The inference server was stopped."))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, state: np.ndarray) -> Future:
+        """Queue an observation, the returned future resolving to its greedy action."""
+        with self.lock:
+            if not self.running:
+                raise RuntimeError("The server must be started before submitting observations.")
+            return self._put(state)
+
+    def _put(self, state: np.ndarray) -> Future:
+        # with the lock held
+        future = Future()
+        self.requests.put((np.array(state, copy=True), future))
+        return future
+
+    def get_action(self, state: np.ndarray, timeout: float = None) -> int:
+        """Greedy action of an observation, raising concurrent.futures.TimeoutError after timeout seconds."""
+        return self.submit(state).result(timeout)
+
+    def get_actions(self, states: np.ndarray, timeout: float = None) -> np.ndarray:
+        """
+        Greedy actions of observations stacked along the first dimension, in batches of max_batch_size: through the
+        worker while the server is running, directly on the caller's thread otherwise.
+        """
+        with self.lock:  # all queued ahead of a concurrent stop signal, or none
+            futures = [self._put(state) for state in states] if self.running else None
+        if futures is not None:
+            return np.array([future.result(timeout) for future in futures])
+        actions = [self.net.predict_batch(states[i:i + self.max_batch_size], idmax=True)
+                   for i in range(0, len(states), self.max_batch_size)]
+        return np.concatenate(actions)
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.n_requests / max(self.n_batches, 1)
+
+    def _serve(self):
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.perf_counter() + self.max_latency_ms / 1e3
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: list):
+        states, futures = zip(*batch)
+        try:
+            actions = self.net.predict_batch(np.stack(states), idmax=True)
+        except Exception as exception:
+            for future in futures:
+                future.set_exception(exception)
+            return
+        for future, action in zip(futures, actions.tolist()):
+            future.set_result(action)
+        self.n_batches += 1
+        self.n_requests += len(batch)
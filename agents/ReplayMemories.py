@@ -0,0 +1,231 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class ReplayMemory:
+    """
+    Replay memory of (state, action, reward, next_state, done) transitions, held in one preallocated array per field
+    and written circularly, the oldest transition being overwritten once capacity transitions are held (as with a
+    deque(maxlen=capacity)). The arrays are allocated at the first transition, once the state shape is known, so the
+    memory used is fixed from then on, and a batch is sampled with one index gather per field.
+    States are stored in state_dtype (float32 by default, the precision the networks read them in).
+    """
+
+    def __init__(self, capacity: int = int(10e5), state_dtype: type = np.float32, seed: Optional[int] = None):
+        self.capacity = capacity
+        self.state_dtype = state_dtype
+        self.rng = np.random.default_rng(seed)
+        self.states: np.ndarray = None
+        self.actions: np.ndarray = None
+        self.rewards: np.ndarray = None
+        self.next_states: np.ndarray = None
+        self.dones: np.ndarray = None
+        self.size = 0
+        self.head = 0  # slot of the next transition
+
+    def append(self, transition: Sequence):
+        state, action, reward, next_state, done = transition
+        if self.states is None:
+            self._allocate(np.shape(state))
+        self.states[self.head] = state
+        self.actions[self.head] = action
+        self.rewards[self.head] = reward
+        self.next_states[self.head] = next_state
+        self.dones[self.head] = done
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def sample(self, batch_size: int) -> tuple:
+        """Batch of distinct transitions drawn uniformly: states, actions, rewards, next_states, dones."""
+        indices = self.rng.choice(self.size, size=batch_size, replace=False)
+        return self.gather(self.get_slots(indices))
+
+    def get_slots(self, indices: np.ndarray) -> np.ndarray:
+        """Array slots of the transitions given by their index from the oldest one held."""
+        return (self.head - self.size + indices) % self.capacity
+
+    def gather(self, slots: np.ndarray) -> tuple:
+        return (self.states[slots], self.actions[slots], self.rewards[slots], self.next_states[slots],
+                self.dones[slots])
+
+    @property
+    def nbytes(self) -> int:
+        if self.states is None:
+            return 0
+        return sum(array.nbytes for array in (self.states, self.actions, self.rewards, self.next_states, self.dones))
+
+    def _allocate(self, state_shape: tuple):
+        self.states = np.zeros((self.capacity,) + state_shape, dtype=self.state_dtype)
+        self.next_states = np.zeros((self.capacity,) + state_shape, dtype=self.state_dtype)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float64)
+        self.dones = np.zeros(self.capacity, dtype=bool)
+
+
+class SequenceReplayMemory(ReplayMemory):
+    """
+    Replay memory of transitions between lag windows (states of shape (n_lags, n_features)), storing every feature row
+    once. Consecutive transitions of an episode share all but one row of their windows, so the rows are appended to a
+    single circular row array, each transition only keeping the position of the last row of its next state, and the
+    state and next state windows are gathered back at sample time with one fancy index over the rows.
+    A transition whose state is not the next state of the previous transition (the first transition of an episode)
+    first writes the rows of its whole state window. The row array holds capacity + n_lags rows, so that transitions
+    whose oldest row has been overwritten are evicted: with several episodes in memory, slightly fewer than capacity
+    transitions are then held.
+    """
+
+    def __init__(self, capacity: int = int(10e5), state_dtype: type = np.float32, seed: Optional[int] = None):
+        super().__init__(capacity, state_dtype, seed)
+        self.rows: np.ndarray = None
+        self.ends: np.ndarray = None
+        self.n_lags = 0
+        self.row_capacity = 0
+        self.n_rows_written = 0
+        self.last_next_state: np.ndarray = None
+
+    def append(self, transition: Sequence):
+        state, action, reward, next_state, done = transition
+        if self.rows is None:
+            self._allocate(np.shape(state))
+        if not self._continues_last_transition(state):
+            for row in state:
+                self._push_row(row)
+        self._push_row(next_state[-1])
+        self.ends[self.head] = self.n_rows_written - 1
+        self.actions[self.head] = action
+        self.rewards[self.head] = reward
+        self.dones[self.head] = done
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.last_next_state = None if done else next_state
+        self._evict_overwritten()
+
+    def gather(self, slots: np.ndarray) -> tuple:
+        ends = self.ends[slots]
+        positions = (ends[:, None] + np.arange(-self.n_lags, 1)) % self.row_capacity
+        windows = self.rows[positions]  # (batch_size, n_lags + 1, n_features): both windows in one gather
+        return windows[:, :-1], self.actions[slots], self.rewards[slots], windows[:, 1:], self.dones[slots]
+
+    @property
+    def nbytes(self) -> int:
+        if self.rows is None:
+            return 0
+        return sum(array.nbytes for array in (self.rows, self.ends, self.actions, self.rewards, self.dones))
+
+    def _allocate(self, state_shape: tuple):
+        assert len(state_shape) == 2, "Sequence replay needs (n_lags, n_features) lag windows as states."
+        self.n_lags, n_features = state_shape
+        self.row_capacity = self.capacity + self.n_lags
+        self.rows = np.zeros((self.row_capacity, n_features), dtype=self.state_dtype)
+        self.ends = np.zeros(self.capacity, dtype=np.int64)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float64)
+        self.dones = np.zeros(self.capacity, dtype=bool)
+
+    def _continues_last_transition(self, state: np.ndarray) -> bool:
+        if self.last_next_state is None:
+            return False
+        return state is self.last_next_state or np.array_equal(state, self.last_next_state)
+
+    def _push_row(self, row: np.ndarray):
+        self.rows[self.n_rows_written % self.row_capacity] = row
+        self.n_rows_written += 1
+
+    def _evict_overwritten(self):
+        """Drop the oldest transitions whose state window starts at a row that has been overwritten."""
+        oldest_valid_row = self.n_rows_written - self.row_capacity
+        while self.size > 0 and self.ends[(self.head - self.size) % self.capacity] - self.n_lags < oldest_valid_row:
+            self.size -= 1
+
+
+class SumTree:
+    """
+    Binary tree of priorities in a flat array, each node holding the sum of its children's priorities and the leaves
+    (n_leaves, a power of two, from index n_leaves on) the priorities of the memory slots. Priorities are updated and
+    slots are drawn proportionally to them by batch, walking the log2(n_leaves) levels with vectorised operations.
+    """
+
+    def __init__(self, capacity: int):
+        self.n_leaves = 1 << max(int(np.ceil(np.log2(max(capacity, 1)))), 0)
+        self.depth = int(np.log2(self.n_leaves))
+        self.nodes = np.zeros(2 * self.n_leaves, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return self.nodes[1]
+
+    def get(self, slots: np.ndarray) -> np.ndarray:
+        return self.nodes[self.n_leaves + np.asarray(slots)]
+
+    def update(self, slots: np.ndarray, priorities: np.ndarray):
+        indices = self.n_leaves + np.asarray(slots)
+        self.nodes[indices] = priorities  # for repeated slots, the last priority given is kept
+        for _ in range(self.depth):
+            indices = np.unique(indices // 2)
+            self.nodes[indices] = self.nodes[2 * indices] + self.nodes[2 * indices + 1]
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """Slots whose cumulated priority interval contains each value of [0, total)."""
+        values = np.minimum(np.asarray(values, dtype=np.float64), np.nextafter(self.total, 0))
+        indices = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * indices
+            left_sums = self.nodes[left]
+            go_right = values >= left_sums
+            values = np.where(go_right, values - left_sums, values)
+            indices = left + go_right
+        return indices - self.n_leaves
+
+
+class PrioritisedReplayMemory:
+    """
+    Proportional prioritised replay (Schaul et al., 2016) over a ReplayMemory or SequenceReplayMemory: transitions are
+    drawn with probability priority^alpha / sum, the priorities being the absolute TD errors of their last replay (new
+    transitions get the highest priority seen, so that they are replayed at least once). Sampling is stratified over
+    batch_size equal segments of the total priority, and the returned importance sampling weights,
+    (size * probability)^-beta normalised by their maximum, correct the bias of the non-uniform sampling, beta being
+    annealed to 1 by beta_increment per batch.
+    """
+
+    def __init__(self, memory: ReplayMemory, alpha: float = 0.6, beta: float = 0.4, beta_increment: float = 1e-3,
+                 epsilon: float = 1e-6, seed: Optional[int] = None):
+        self.memory = memory
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.rng = np.random.default_rng(seed)
+        self.tree = SumTree(memory.capacity)
+        self.max_priority = 1.0
+
+    def append(self, transition: Sequence):
+        oldest = (self.memory.head - self.memory.size) % self.memory.capacity
+        slot = self.memory.head
+        self.memory.append(transition)
+        # Transitions evicted by the memory (overwritten, or whose rows were overwritten) can no longer be drawn
+        n_evicted = (self.memory.head - self.memory.size - oldest) % self.memory.capacity
+        if n_evicted > 0:
+            self.tree.update((oldest + np.arange(n_evicted)) % self.memory.capacity, 0.0)
+        self.tree.update(np.array([slot]), self.max_priority)
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def sample(self, batch_size: int) -> tuple:
+        """Batch of transitions (as ReplayMemory.sample), their importance sampling weights and their slots."""
+        segment = self.tree.total / batch_size
+        slots = self.tree.find((np.arange(batch_size) + self.rng.random(batch_size)) * segment)
+        probabilities = self.tree.get(slots) / self.tree.total
+        weights = (len(self.memory) * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return self.memory.gather(slots), weights, slots
+
+    def update_priorities(self, slots: np.ndarray, td_errors: np.ndarray):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.tree.update(slots, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
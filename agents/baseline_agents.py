@@ -2,8 +2,10 @@ import abc
 
 import numpy as np
 import random
+import torch
 
 from agents.Agent import Agent
+from agents.ReplayMemories import PrioritisedReplayMemory
 from mygym.HistoricalOrderbookEnvironment import HistoricalOrderbookEnvironment
 
 from agents.value_approximators.baseline_nets import Net
@@ -66,11 +68,17 @@ class BaseDQN(Agent):
             gamma: float = 0.97,
             batch_size: int = 512,
             type_algo: str = 'target',
-            tau: float = 0.01
+            tau: float = 0.01,
+            prioritised_replay: bool = False,
+            quantised_inference: str = None
     ):
         super().__init__(learn_env, valid_env, True, episodes, epsilon, epsilon_min, epsilon_decay, gamma, batch_size)
         self.type_algo = type_algo
         self.tau = tau
+        self.prioritised_replay = prioritised_replay
+        if self.prioritised_replay:
+            self.memory = PrioritisedReplayMemory(self.memory, seed=self.seed)
+        self.quantised_inference = quantised_inference  # None, or the precision of Net.quantise
         #self.replay_steps = 0
         self._set_seed_rand()
 
@@ -78,7 +86,7 @@ class BaseDQN(Agent):
         random.seed(self.seed)
 
     @abc.abstractmethod
-    def _compute_fit(self, state: np.ndarray, target, mask: np.ndarray = None):
+    def _compute_fit(self, state: np.ndarray, target, weights: np.ndarray = None):
         pass
 
     @abc.abstractmethod
@@ -89,9 +97,27 @@ class BaseDQN(Agent):
         """
         optimal policy is defined trivially as: when the agent is in state s, it will select the action with the highest
         value for that state
+        With quantised inference, the action is computed by the reduced precision copy of the model
         """
+        if self.quantised_inference is not None:
+            return self.model.predict_quantised(state, idmax=True, precision=self.quantised_inference)
         return self._compute_prediction(self.model, state, idmax=True)
 
+    def check_quantised_inference(self, env: HistoricalOrderbookEnvironment = None, precision: str = 'qint8') -> float:
+        """
+        Play a held-out episode (on the test environment by default) with the float model's greedy policy and return
+        the share of its steps where the quantised model would take the same action
+        """
+        env = env or self.test_env
+        state = env.reset(random_time=False)
+        states = list()
+        while env.end_of_trading_ns >= env.state.now_is:
+            states.append(np.array(state, copy=True))
+            state, reward, done, info = env.step(self._compute_prediction(self.model, state, idmax=True))
+            if done:
+                break
+        return self.model.check_quantisation(states, precision)
+
     def _set_target_model(self):
         self.target_model = deepcopy(self.model)
         for param in self.target_model.model.parameters():
@@ -101,32 +127,40 @@ class BaseDQN(Agent):
         """
         Method to retrain the DQN model based on batches of memorized experiences
         Updating the policy function Q regularly, improve the learning considerably
+        With prioritised replay, transitions are drawn according to their last TD error, and the loss is weighted by
+        their importance sampling weights
+        The whole update runs on tensors on the model's device: the online network evaluates the next states and the
+        states in one forward pass, and the target network is moved towards it in place
         """
-        batch = list(map(np.array, zip(*random.sample(self.memory, self.batch_size))))
-        states, actions, rewards, next_states, dones = batch
+        weights = None
+        if self.prioritised_replay:
+            (states, actions, rewards, next_states, dones), weights, slots = self.memory.sample(self.batch_size)
+            weights = self.model.to_tensor(weights)
+        else:
+            states, actions, rewards, next_states, dones = self.memory.sample(self.batch_size)
+        states, next_states = self.model.to_tensor(states), self.model.to_tensor(next_states)
+        actions = self.model.to_tensor(actions, torch.int64).unsqueeze(1)
+        rewards, dones = self.model.to_tensor(rewards), self.model.to_tensor(dones)
+        Q_values_next_step, all_Q_values = self.model.evaluate_batch(torch.cat([next_states, states])).split(len(actions))
         """
         approximate Q-Value(target) should be close to the reward the agent gets after playing action a in state s
         plus the future discounted value of playing optimally from then on
         """
         if self.type_algo == 'target':
-            actions_next_step = np.argmax(self._compute_prediction(self.model, next_states, idmax=False).cpu().numpy(), axis=1)
-            Q_values_target_next_step = self._compute_prediction(self.target_model, next_states, idmax=False).cpu().numpy()[range(len(actions)), actions_next_step]
-            rewards += (1 - dones) * self.gamma * Q_values_target_next_step
+            actions_next_step = Q_values_next_step.argmax(dim=1, keepdim=True)
+            Q_values_target_next_step = self.target_model.evaluate_batch(next_states).gather(1, actions_next_step)
+            targets = rewards + (1 - dones) * self.gamma * Q_values_target_next_step.squeeze(1)
         else:
-            rewards += (1 - dones) * self.gamma * np.amax(self._compute_prediction(self.model, next_states, idmax=False).cpu().numpy(),
-                                                          axis=1)
+            targets = rewards + (1 - dones) * self.gamma * Q_values_next_step.amax(dim=1)
 
-        all_Q_values = self._compute_prediction(self.model, states, idmax=False).cpu().numpy()
-        all_Q_values_target = all_Q_values.copy()
-        all_Q_values_target[range(len(actions)), actions] = rewards
-        self._compute_fit(states, all_Q_values_target)
+        all_Q_values_target = all_Q_values.scatter(1, actions, targets.unsqueeze(1))
+        if self.prioritised_replay:
+            td_errors = targets - all_Q_values.gather(1, actions).squeeze(1)
+            self.memory.update_priorities(slots, td_errors.cpu().numpy())
+        self.model.fit_batch(states, all_Q_values_target, weights)
 
         if self.type_algo == 'target':
-            target_net_state_dict = self.target_model.model.state_dict()
-            policy_net_state_dict = self.model.model.state_dict()
-            for key in policy_net_state_dict:
-                target_net_state_dict[key] = policy_net_state_dict[key] * self.tau + target_net_state_dict[key] * (1 - self.tau)
-            self.target_model.model.load_state_dict(target_net_state_dict)
+            self.target_model.soft_update(self.model, self.tau)
 
 
 class DnnAgent(BaseDQN):
@@ -137,10 +171,12 @@ class DnnAgent(BaseDQN):
             hidden_dim: int = 256,
             n_hidden: int = 1,
             lr: float = 0.001,
-            dropout: float = 0.1
-
+            dropout: float = 0.1,
+            prioritised_replay: bool = False,
+            quantised_inference: str = None
     ):
-        super().__init__(learn_env, valid_env)
+        super().__init__(learn_env, valid_env, prioritised_replay=prioritised_replay,
+                         quantised_inference=quantised_inference)
         self._set_model(hidden_dim, n_hidden, lr, dropout)
         self._set_target_model()
 
@@ -162,8 +198,8 @@ class DnnAgent(BaseDQN):
         self.model = Net(DNN(params), lr=lr, name=self.get_name(), seed=self.seed)
         summary(self.model.model, (1, len(self.learn_env.features)))
 
-    def _compute_fit(self, state: np.ndarray, target):
-        self.model.fit(state, target)
+    def _compute_fit(self, state: np.ndarray, target, weights: np.ndarray = None):
+        self.model.fit(state, target, weights)
 
     def _compute_prediction(self, model, state: np.ndarray, idmax: bool):
         return model.predict(state, idmax=idmax)
@@ -177,10 +213,17 @@ class LstmAgent(BaseDQN):
             hidden_dim: int = 256,
             n_hidden: int = 1,
             lr: float = 0.001,
-            dropout: float = 0.1
-
+            dropout: float = 0.1,
+            prioritised_replay: bool = False,
+            quantised_inference: str = None,
+            streaming_inference: bool = False,
+            n_streams: int = None
     ):
-        super().__init__(learn_env, valid_env)
+        super().__init__(learn_env, valid_env, prioritised_replay=prioritised_replay,
+                         quantised_inference=quantised_inference)
+        assert not (streaming_inference and quantised_inference), "Streaming inference runs the float model only."
+        self.streaming_inference = streaming_inference
+        self.n_streams = n_streams  # None: one stream per lag, exactly the windowed policy, see StreamingLSTM
         self._set_model(hidden_dim, n_hidden, lr, dropout)
         self._set_target_model()
 
@@ -201,8 +244,21 @@ class LstmAgent(BaseDQN):
         self.model = Net(LSTM(params), lr=lr, name=self.get_name(), seed=self.seed)
         summary(self.model.model, (self.learn_env.n_lags_feature, len(self.learn_env.features)))
 
-    def _compute_fit(self, state: np.ndarray, target):
-        self.model.fit(state, target)
+    def _compute_fit(self, state: np.ndarray, target, weights: np.ndarray = None):
+        self.model.fit(state, target, weights)
 
     def _compute_prediction(self, model, state: np.ndarray, idmax: bool):
         return model.predict(state, idmax=idmax)
+
+    def get_action(self, state: np.ndarray):
+        """
+        With streaming inference, the LSTM states are carried from one step to the next and only the feature rows of
+        the lag window that are new since the previous call are fed (see Net.predict_streaming), at the position of the
+        state in the episode of the environment acting: with n_streams = n_lags (by default) the actions are the
+        windowed ones, with fewer streams an approximation of them
+        """
+        if self.streaming_inference:
+            env = self.acting_env
+            return self.model.predict_streaming(state, env.episode_step, (id(env), env.n_resets), idmax=True,
+                                                n_streams=self.n_streams)
+        return super().get_action(state)
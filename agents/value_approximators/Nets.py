@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import numpy as np
 from dataclasses import dataclass
 
 
@@ -98,9 +99,67 @@ class LSTM(nn.Module):
     def forward(self, x):
         for i, layer in enumerate(self.stack_layers):
             if isinstance(layer, nn.LSTM):
-                getattr(self, f'Layer_{str(i + 1).zfill(3)}').flatten_parameters()
-                x, (hn, cn) = getattr(self, f'Layer_{str(i + 1).zfill(3)}')(x)
+                lstm = getattr(self, f'Layer_{str(i + 1).zfill(3)}')
+                if hasattr(lstm, 'flatten_parameters'): lstm.flatten_parameters()  # not on quantised LSTMs
+                x, (hn, cn) = lstm(x)
             else:
                 x = getattr(self, f'Layer_{str(i + 1).zfill(3)}')(x)
         x = self.linear(x[:, -1, :])
-        return x
\ No newline at end of file
+        return x
+
+
+class StreamingLSTM:
+    """
+    Step-by-step inference of an LSTM model over the window of its last window_size input rows, carrying the hidden
+    and cell states from one step to the next so that each step only feeds the newest input row.
+    A single carried state would read the whole stream instead of the window the model was trained on, so n_streams
+    states are carried in a batch, each reset to zero every window_size rows, at offsets spread over the window, and
+    the output is read from the stream reset the longest ago. With n_streams = window_size (the default), that stream
+    reads exactly the window and the outputs are those of the model on the window. With fewer streams, the outputs are
+    only an approximation of the trained policy: the stream read covers the last window_size - k + 1 rows, with k up
+    to window_size / n_streams, for a cost proportional to n_streams. A step is one LSTM cell step of the batch of
+    streams per layer.
+    """
+
+    def __init__(self, model: LSTM, window_size: int, n_streams: int = None):
+        self.model = model
+        self.window_size = window_size
+        self.n_streams = n_streams or window_size
+        assert 1 <= self.n_streams <= window_size, "There must be between 1 and window_size streams."
+        offsets = np.arange(self.n_streams) * window_size // self.n_streams  # row of the first reset of each stream
+        phases = np.arange(window_size)[:, None]
+        # Per phase (row number modulo window_size): states to keep, zero for the streams reset before that row, and
+        # stream fed for the longest since its last reset, once every stream has been reset at least once
+        device = next(model.parameters()).device
+        self.keep = torch.as_tensor((phases - offsets) % window_size != 0, dtype=torch.float32, device=device)
+        self.keep = self.keep.reshape(window_size, self.n_streams, 1)
+        self.readout = np.argmax((phases - offsets) % window_size, axis=1).tolist()
+        self.reset()
+
+    def reset(self):
+        self.n_rows = 0
+        self.states = [None] * len(self.model.stack_layers)
+        self.model.eval()
+
+    @torch.no_grad()
+    def push(self, row: torch.Tensor) -> torch.Tensor:
+        """Feed the next input row and return the model output on the window ending with it."""
+        phase = self.n_rows % self.window_size
+        x = row.reshape(1, -1).expand(self.n_streams, -1)
+        for i, layer in enumerate(self.model.stack_layers):
+            if isinstance(layer, nn.LSTM):
+                # one LSTM cell step, without the fixed cost of running nn.LSTM over a sequence of one row
+                if self.states[i] is None:
+                    hidden = cell = x.new_zeros(self.n_streams, layer.hidden_size)
+                else:
+                    hidden, cell = self.states[i]
+                    hidden, cell = hidden * self.keep[phase], cell * self.keep[phase]
+                self.states[i] = torch.lstm_cell(x, (hidden, cell), layer.weight_ih_l0, layer.weight_hh_l0,
+                                                 layer.bias_ih_l0, layer.bias_hh_l0)
+                x = self.states[i][0]
+            else:
+                x = layer(x)
+        self.n_rows += 1
+        # before its first reset, a stream has been fed all the rows so far: any stream has the whole context
+        stream = self.readout[phase] if self.n_rows >= self.window_size else 0
+        return self.model.linear(x[stream:stream + 1])
@@ -0,0 +1,71 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+
+class NumpyNet:
+    """
+    Torch-free inference of the DNN and LSTM models of Nets.py, from the weight file written by Net.export. The layers
+    are evaluated in float32 with the same input layout as Net.predict (a single state gets a leading batch dimension,
+    and the DNN reads the first element of its batch), so the Q-values agree with those of the torch model to float32
+    rounding and the greedy actions are the same. Loading and a single-sample prediction only cost a few NumPy calls,
+    without importing torch.
+    """
+
+    def __init__(self, architecture: str, layers: List[Tuple[np.ndarray, ...]], linear: Tuple[np.ndarray, np.ndarray]):
+        assert architecture in ["DNN", "LSTM"], f"{architecture} has not been implemented"
+        self.architecture = architecture
+        self.layers = layers
+        self.linear = linear
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyNet":
+        with np.load(path) as weights:
+            architecture = str(weights["architecture"])
+            n_layers = int(weights["n_layers"])
+            names = ("weight_ih", "weight_hh", "bias") if architecture == "LSTM" else ("weight", "bias")
+            layers = [tuple(weights[f"layer_{i}_{name}"] for name in names) for i in range(n_layers)]
+            linear = (weights["linear_weight"], weights["linear_bias"])
+        return cls(architecture, layers, linear)
+
+    def forward(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim in [1, 2]:
+            x = x[np.newaxis]
+        if self.architecture == "DNN":
+            for weight, bias in self.layers:
+                x = np.maximum(x @ weight.T + bias, 0)
+            x = x[0]
+        else:
+            for weight_ih, weight_hh, bias in self.layers:
+                x = self._lstm(x, weight_ih, weight_hh, bias)
+            x = x[:, -1, :]
+        weight, bias = self.linear
+        return x @ weight.T + bias
+
+    def predict(self, state: np.ndarray, idmax: bool = None):
+        output = self.forward(state)
+        if idmax: output = int(np.argmax(output))
+        return output
+
+    @staticmethod
+    def _lstm(x: np.ndarray, weight_ih: np.ndarray, weight_hh: np.ndarray, bias: np.ndarray) -> np.ndarray:
+        """Single layer LSTM over (batch, sequence, features) inputs, with PyTorch's (input, forget, cell, output)
+        gate layout and zero initial states."""
+        batch_size, sequence_length, _ = x.shape
+        hidden_size = weight_hh.shape[1]
+        input_gates = x @ weight_ih.T + bias  # input projections of all the steps at once
+        hidden = np.zeros((batch_size, hidden_size), dtype=np.float32)
+        cell = np.zeros((batch_size, hidden_size), dtype=np.float32)
+        outputs = np.empty((batch_size, sequence_length, hidden_size), dtype=np.float32)
+        for t in range(sequence_length):
+            gates = input_gates[:, t] + hidden @ weight_hh.T
+            i, f, g, o = np.split(gates, 4, axis=1)
+            cell = sigmoid(f) * cell + sigmoid(i) * np.tanh(g)
+            hidden = sigmoid(o) * np.tanh(cell)
+            outputs[:, t] = hidden
+        return outputs
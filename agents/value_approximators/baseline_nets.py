@@ -4,6 +4,10 @@ from torch.optim import Adam, SGD
 import os
 import numpy as np
 import time
+import warnings
+from copy import deepcopy
+
+from agents.value_approximators.Nets import StreamingLSTM
 
 
 class Net:
@@ -25,6 +29,13 @@ class Net:
         self.val_loss = None
         self.path = None
         self.name = name
+        self.n_updates = 0  # number of changes of the weights, invalidating the streaming inference states
+        self.streaming: StreamingLSTM = None
+        self.streaming_n_updates = 0  # n_updates of the weights the streaming states were computed with
+        self.streaming_position: tuple = None  # (episode, step) of the last window fed to the streaming states
+        self.last_output: torch.Tensor = None
+        self.quantised_model = None
+        self.quantised_key = None  # (precision, n_updates) of the quantised model
         self.__set_seed()
         self.__instantiate_model(model)
         self.__instantiate_optimizer()
@@ -39,6 +50,7 @@ class Net:
         last_episode = Utils.find_last_episode(path.replace('EpisodeNone', '')) if episode==0 else episode
         path = path.replace('None', str(last_episode)) + f'_{prefix}model.pkl'
         self.model, self.optimizer = Utils.load(self.model, self.optimizer, path, self.device)
+        self.n_updates += 1
         return last_episode
 
     def __instantiate_optimizer(self):
@@ -63,21 +75,32 @@ class Net:
                 return state, target
         return state
 
-    def __train_model(self, state: np.ndarray, target: torch.tensor):
-        # set the model in training mode
-        self.model.train()
+    def __train_model(self, state: np.ndarray, target: torch.tensor, weights: np.ndarray = None):
         # send input to device
         state, target = self.__transf(state, target)
         state, target = Utils.to_device((state, target), self.device)
+        if weights is not None:
+            weights = self.to_tensor(weights)
+        return self.__optimise(state, target, weights)
+
+    def __optimise(self, state: torch.Tensor, target: torch.Tensor, weights: torch.Tensor = None):
+        # set the model in training mode
+        self.model.train()
         # zero out previous accumulated gradients
         self.optimizer.zero_grad() #not needed as no batch
         # perform forward pass and calculate accuracy + loss
         all_Q_values = self.model(state)
-        loss = self.criterion(all_Q_values, target)
+        if weights is None:
+            loss = self.criterion(all_Q_values, target)
+        else:
+            # per-sample (importance sampling) weights of the elementwise loss
+            losses = nn.functional.smooth_l1_loss(all_Q_values, target, reduction='none', beta=self.criterion.beta)
+            loss = (losses * weights.unsqueeze(1)).mean()
         # perform backpropagation and update model parameters
         loss.backward()
         torch.nn.utils.clip_grad_value_(self.model.parameters(), 100)
         self.optimizer.step()
+        self.n_updates += 1
         return loss.item()
 
     @torch.no_grad()
@@ -91,13 +114,45 @@ class Net:
         if idmax: output = Utils.argmax(output)
         return output
 
+    @staticmethod
+    def __to_model_input(states: torch.Tensor):
+        # the models read a batch of DNN states (or a single state) with a leading dimension, as in __transf
+        return states.unsqueeze(0) if states.dim() in [1, 2] else states
+
+    def to_tensor(self, array: np.ndarray, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+        return torch.as_tensor(array, dtype=dtype).to(self.device, non_blocking=True)
+
+    @torch.no_grad()
+    def evaluate_batch(self, states: torch.Tensor) -> torch.Tensor:
+        """Q-values of a batch of states, given and returned as tensors on the device."""
+        self.model.eval()
+        return self.model(self.__to_model_input(states))
+
+    def fit_batch(self, states: torch.Tensor, target: torch.Tensor, weights: torch.Tensor = None):
+        """Same as fit, for a batch of states and targets already on the device."""
+        start_time = time.time()
+        train_loss = self.__optimise(self.__to_model_input(states), target, weights)
+        if self.verbose:
+            self.__compute_verbose_train(1, start_time, train_loss)
+        self.train_loss = train_loss
+
+    @torch.no_grad()
+    def soft_update(self, source: "Net", tau: float):
+        """Move the parameters (and floating point buffers) towards those of source by tau, in place."""
+        for target_tensor, source_tensor in zip(self.model.state_dict().values(), source.model.state_dict().values()):
+            if target_tensor.is_floating_point():
+                target_tensor.lerp_(source_tensor, tau)
+            else:
+                target_tensor.copy_(source_tensor)
+        self.n_updates += 1
+
     def __compute_verbose_train(self, epoch, start_time, train_loss):
         print("Epoch [{}] took {:.2f}s | train_loss: {:.4f}".format(epoch, time.time() - start_time, train_loss))
 
-    def fit(self, state: np.ndarray, target: torch.tensor):
+    def fit(self, state: np.ndarray, target: torch.tensor, weights: np.ndarray = None):
 
         start_time = time.time()
-        train_loss = self.__train_model(state, target)
+        train_loss = self.__train_model(state, target, weights)
 
         if self.verbose:
             self.__compute_verbose_train(1, start_time, train_loss)
@@ -108,10 +163,114 @@ class Net:
         if path is not None: path = path + f'_{prefix}model.pkl'
         Utils.save(self.model, self.optimizer, path)
 
+    def predict_batch(self, states: np.ndarray, idmax: bool = None):
+        """
+        Q-values (or greedy actions) of a batch of states of several environments, stacked along the first dimension,
+        in one forward pass
+        """
+        states = self.to_tensor(states)
+        if not isinstance(self.model.stack_layers[0], nn.LSTM):
+            states = states.reshape(len(states), -1)  # DNN states (features or (1, features)) as rows of one batch
+        output = self.evaluate_batch(states)
+        if idmax: output = output.argmax(dim=1).cpu().numpy()
+        return output
+
+    def export(self, path: str, prefix: str = ''):
+        """
+        Write the weights to a compact .npz file (next to the save_args checkpoint) for the torch-free NumpyNet
+        """
+        weights = dict(architecture=type(self.model).__name__)
+        layers = [layer for layer in self.model.stack_layers if isinstance(layer, (nn.Linear, nn.LSTM))]
+        for i, layer in enumerate(layers):
+            if isinstance(layer, nn.LSTM):
+                weights[f'layer_{i}_weight_ih'] = layer.weight_ih_l0
+                weights[f'layer_{i}_weight_hh'] = layer.weight_hh_l0
+                weights[f'layer_{i}_bias'] = layer.bias_ih_l0 + layer.bias_hh_l0
+            else:
+                weights[f'layer_{i}_weight'] = layer.weight
+                weights[f'layer_{i}_bias'] = layer.bias
+        weights['linear_weight'] = self.model.linear.weight
+        weights['linear_bias'] = self.model.linear.bias
+        weights = {name: value.detach().cpu().numpy() if torch.is_tensor(value) else value
+                   for name, value in weights.items()}
+        np.savez(path + f'_{prefix}model.npz', n_layers=len(layers), **weights)
+
     def predict(self, state: np.ndarray, idmax: bool=None):
         prediction = self.__evaluate_model(state, idmax)
         return prediction
 
+    def quantise(self, precision: str = 'qint8'):
+        """
+        Reduced precision copy of the model for CPU inference: 'qint8' dynamically quantises the weights of the linear
+        and LSTM layers to int8 (activations are quantised on the fly), 'bfloat16' casts the whole model to bfloat16
+        """
+        model = deepcopy(self.model).eval()
+        if precision == 'qint8':
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')  # the eager mode quantisation API is deprecated in recent versions
+                model = torch.ao.quantization.quantize_dynamic(model.cpu(), {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+        elif precision == 'bfloat16':
+            model = model.to(torch.bfloat16)
+        else:
+            raise ValueError(f"Unsupported precision {precision!r}: supported precisions are 'qint8', 'bfloat16'")
+        return model
+
+    @torch.no_grad()
+    def predict_quantised(self, state: np.ndarray, idmax: bool = None, precision: str = 'qint8'):
+        """
+        Same as predict with the quantised model, rebuilt whenever the weights have changed
+        """
+        if self.quantised_key != (precision, self.n_updates):
+            self.quantised_model = self.quantise(precision)
+            self.quantised_key = (precision, self.n_updates)
+        # quantised linear layers need 2-D inputs, so a single DNN state is fed as a batch of one
+        inputs = self.__transf(np.reshape(state, (1, -1)) if np.ndim(state) == 1 else state)
+        if precision == 'qint8':
+            output = self.quantised_model(inputs)
+        else:
+            output = self.quantised_model(Utils.to_device(inputs, self.device).to(torch.bfloat16)).float()
+        if np.ndim(state) == 1: output = output[0]
+        if idmax: output = Utils.argmax(output)
+        return output
+
+    def check_quantisation(self, states: list, precision: str = 'qint8') -> float:
+        """
+        Calibration check of the quantised model: share of the states whose greedy action is the float model's one
+        """
+        agreements = [self.predict(state, idmax=True) == self.predict_quantised(state, True, precision)
+                      for state in states]
+        return float(np.mean(agreements))
+
+    def predict_streaming(self, window: np.ndarray, step: int, episode=None, idmax: bool = None,
+                          n_streams: int = None):
+        """
+        Same as predict for the lag window of an LSTM model (exactly with the default n_streams, see StreamingLSTM),
+        computed by a StreamingLSTM fed only the rows that are new since the previous call. The caller gives the
+        position of the window: step, the number of environment steps since the reset, and episode, any key of the
+        environment and its episode. The rows of the steps without a call (e.g. exploration steps) are caught up from
+        the window, the same step returns the previous output, and the streams are rebuilt from the whole window for
+        another episode, a step back or a change of the weights.
+        """
+        if self.streaming is None or (self.streaming.window_size, self.streaming.n_streams) != (
+                len(window), n_streams or len(window)):
+            self.streaming = StreamingLSTM(self.model, len(window), n_streams)
+            self.streaming_position = None
+        last_episode, last_step = self.streaming_position or (None, None)
+        if last_step is None or episode != last_episode or step < last_step or \
+                self.streaming_n_updates != self.n_updates:
+            self.streaming.reset()
+            self.streaming_n_updates = self.n_updates
+            n_new_rows = len(window)
+        else:
+            n_new_rows = min(step - last_step, len(window))
+        if n_new_rows > 0:
+            for row in self.to_tensor(window[len(window) - n_new_rows:]):
+                self.last_output = self.streaming.push(row)
+        self.streaming_position = (episode, step)
+        output = self.last_output
+        if idmax: output = Utils.argmax(output)
+        return output
+
 
 class Utils:
     """
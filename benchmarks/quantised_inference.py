@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+
+from agents.value_approximators.baseline_nets import Net
+from agents.value_approximators.Nets import Params, LSTM, DNN
+from benchmarks.step_rate import get_bench_config
+from mygym.utils import env_creator
+
+
+def get_episode_states(env, net: Net):
+    """
+    States of one held-out evaluation episode played with the float model's greedy policy
+    """
+    state = env.reset(random_time=False)
+    states, done = list(), False
+    while not done:
+        states.append(np.array(state, copy=True))
+        state, _, done, _ = env.step(net.predict(state, idmax=True))
+    return states
+
+
+def latency(predict, states: list):
+    """
+    Mean latency in microseconds of a single-state greedy action
+    """
+    start = time.perf_counter()
+    for state in states:
+        predict(state)
+    return (time.perf_counter() - start) / len(states) * 1e6
+
+
+if __name__ == '__main__':
+
+    for model, n_lags_feature in [(DNN, 0), (LSTM, 10), (LSTM, 60)]:
+        env = env_creator(get_bench_config(True, n_lags_feature))
+        params = Params(input_dim=len(env.features), hidden_dim=256, n_hidden=1, dropout=0.1, seed=0)
+        net = Net(model(params), seed=0)
+        states = get_episode_states(env, net)
+        float_latency = latency(lambda state: net.predict(state, idmax=True), states)
+        for precision in ['qint8', 'bfloat16']:
+            agreement = net.check_quantisation(states, precision)
+            quantised_latency = latency(lambda state: net.predict_quantised(state, True, precision), states)
+            print(f'{model.__name__} n_lags_feature={n_lags_feature} | {precision}: greedy action agreement '
+                  f'{agreement:.2%} over {len(states)} steps | float: {float_latency:.0f} us | {precision}: '
+                  f'{quantised_latency:.0f} us | speed-up: {float_latency / quantised_latency:.2f}x')
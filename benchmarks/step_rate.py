@@ -0,0 +1,48 @@
+import time
+from datetime import datetime
+
+from mygym.utils import env_creator
+
+
+def get_bench_config(lean_step: bool, n_lags_feature: int = 0, step_size: float = 1.0):
+    return {
+        "ticker": "MSFT",
+        "start_trading": datetime(2012, 6, 21, 10, 0, 1),
+        "end_trading": datetime(2012, 6, 21, 10, 40),
+        "step_size": step_size,
+        "features": "full_state",
+        "max_inventory": 1e10,
+        "inventory_aversion": 0.1,
+        "normalisation_on": True,
+        "initial_cash": 0,
+        "initial_inventory": 0,
+        "initial_gain": 0,
+        "per_step_reward_function": "AD",
+        "market_order_fraction_of_inventory": 0.99,
+        "n_lags_feature": n_lags_feature,
+        "lean_step": lean_step,
+    }
+
+
+def step_rate(env, n_actions: int = 9):
+    """
+    Run one full evaluation episode cycling through the actions and return the number of steps per second
+    """
+    env.reset(random_time=False)
+    n_steps, done = 0, False
+    start = time.perf_counter()
+    while not done:
+        _, _, done, _ = env.step(n_steps % n_actions)
+        n_steps += 1
+    return n_steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+
+    for n_lags_feature in [0, 60]:
+        rates = dict()
+        for lean_step in [False, True]:
+            env = env_creator(get_bench_config(lean_step, n_lags_feature))
+            rates[lean_step] = step_rate(env)
+        print(f'n_lags_feature={n_lags_feature} | default step: {rates[False]:.1f} steps/s | '
+              f'lean step: {rates[True]:.1f} steps/s | speed-up: {rates[True] / rates[False]:.2f}x')
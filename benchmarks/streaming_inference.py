@@ -0,0 +1,31 @@
+from agents.value_approximators.baseline_nets import Net
+from agents.value_approximators.Nets import Params, LSTM
+from benchmarks.quantised_inference import get_episode_states, latency
+from benchmarks.step_rate import get_bench_config
+from mygym.utils import env_creator
+
+
+if __name__ == '__main__':
+
+    for n_lags_feature, hidden_dim in [(10, 32), (10, 256), (60, 256)]:
+        env = env_creator(get_bench_config(True, n_lags_feature))
+        params = Params(input_dim=len(env.features), hidden_dim=hidden_dim, n_hidden=1, dropout=0.1, seed=0)
+        net = Net(LSTM(params), seed=0)
+        states = get_episode_states(env, net)
+        window_size = len(states[0])
+        q_values = [net.predict(state) for state in states]
+        windowed_latency = latency(lambda state: net.predict(state, idmax=True), states)
+        print(f'n_lags_feature={n_lags_feature} hidden_dim={hidden_dim} | windowed: {windowed_latency:.0f} us')
+        steps = list(range(len(states)))  # the episode states, in order from the reset
+        for n_streams in sorted({1, max(window_size // 8, 1), window_size}):
+            streaming_q_values = [net.predict_streaming(state, step, n_streams=n_streams)
+                                  for step, state in zip(steps, states)]
+            pairs = list(zip(q_values, streaming_q_values))
+            agreement = sum(int(a.argmax()) == int(b.argmax()) for a, b in pairs) / len(pairs)
+            error = max(float((a - b).abs().max()) for a, b in pairs)
+            steps_iter = iter(steps)  # a new pass over the episode, rebuilding the streams at its first step
+            streaming_latency = latency(
+                lambda state: net.predict_streaming(state, next(steps_iter), idmax=True, n_streams=n_streams), states)
+            print(f'    n_streams={n_streams}: {streaming_latency:.0f} us | speed-up: '
+                  f'{windowed_latency / streaming_latency:.2f}x | windowed action agreement {agreement:.2%} | '
+                  f'max Q-value error {error:.1e}')
@@ -1,5 +1,4 @@
-from datetime import datetime
-
+import numpy as np
 import pandas as pd
 
 import os
@@ -9,12 +8,19 @@ from database.database_population_helpers import (
     get_book_and_message_columns,
     get_book_and_message_paths,
     reformat_message_data,
+    PRICE_SCALE,
 )
 
 
 class HistoricalDatabase:
-    def __init__(self, ticker: str = "MSFT"):
+    def __init__(self, ticker: str = "MSFT", integer_prices: bool = False):
+        """
+        With integer_prices, prices are kept in LOBSTER integer units (price_scale per $) instead of being converted
+        to floats, so that book levels, orders and the portfolio cash are exact ints.
+        """
         self.exchange = "NASDAQ"
+        self.integer_prices = integer_prices
+        self.price_scale = PRICE_SCALE if integer_prices else 1
         self.n_levels = 5
         self.book_snapshot_freq = "S"
         self.path_to_lobster_data = "data\\"
@@ -27,17 +33,21 @@ class HistoricalDatabase:
                                                              self.n_levels)
         n_messages = get_file_len(message_path)
         messages = pd.read_csv(message_path, header=None,names=message_cols)
-        self.messages = reformat_message_data(messages, self.trading_date, ticker)
+        self.messages = reformat_message_data(messages, self.trading_date, ticker, self.integer_prices)
         self.books = get_book_snapshots(book_path, book_cols, messages, self.book_snapshot_freq, self.n_levels,
-                                        n_messages)
+                                        n_messages, self.integer_prices)
         self.messages.set_index(['timestamp'], drop=False, inplace=True)
+        # int64 nanosecond views of the (sorted) time indices, searched with the simulator's integer clock
+        self.message_times = self.messages.index.values.astype("datetime64[ns]").view(np.int64)
+        self.book_times = self.books.index.values.astype("datetime64[ns]").view(np.int64)
 
-    def get_last_snapshot(self, timestamp: datetime, ticker: str):
-        return self.books.loc[self.books.index <= timestamp].iloc[-1]
+    def get_last_snapshot(self, timestamp: int, ticker: str):
+        last = np.searchsorted(self.book_times, timestamp, side="right") - 1
+        return self.books.iloc[last] if last >= 0 else self.books.iloc[:0]
 
-    def get_messages(self, start_date: datetime, end_date: datetime, ticker: str):
-        messages = self.messages.loc[(self.messages.index > start_date) & (self.messages.index <= end_date)]
-        if len(messages) > 0:
-            return messages
+    def get_messages(self, start_date: int, end_date: int, ticker: str):
+        first, last = np.searchsorted(self.message_times, [start_date, end_date], side="right")
+        if last > first:
+            return self.messages.iloc[first:last]
         else:
             return pd.DataFrame()
@@ -10,6 +10,8 @@ import glob
 import pandas as pd
 from orderbook.helpers import get_book_columns
 
+PRICE_SCALE = 10000  # LOBSTER prices are integers in units of 1/10000 $, i.e. 100 per 1 cent tick
+
 
 def download_lobster_sample_data(ticker: str, trading_date: str="2012-06-21", n_levels: int = 5):
     path= "\data"
@@ -29,6 +31,7 @@ def get_book_snapshots(
         snapshot_freq: Optional[str],
         n_levels: int,
         total_daily_messages: int,
+        integer_prices: bool = False,
 ):
     first_index, last_index = messages.iloc[[0, -1]].index
     interval_series = get_interval_series(messages, snapshot_freq)
@@ -38,8 +41,9 @@ def get_book_snapshots(
             + list(range(last_index + 1, total_daily_messages))
     )
     books = pd.read_csv(book_path, nrows=len(interval_series), skiprows=rows_to_skip, header=None, names=book_cols)
-    price_columns = [col for col in books.columns if col.find('price') != -1]
-    books[price_columns] /= 10000
+    if not integer_prices:
+        price_columns = [col for col in books.columns if col.find('price') != -1]
+        books[price_columns] /= PRICE_SCALE
     books.index = pd.Series(interval_series.values, name="timestamp")
     return books
 
@@ -66,12 +70,14 @@ def get_book_and_message_paths(data_path: str, ticker: str, trading_date: str, n
     return Path(book_path), Path(message_path)
 
 
-def reformat_message_data(messages: pd.DataFrame, trading_date: str, ticker: str) -> pd.DataFrame:
+def reformat_message_data(messages: pd.DataFrame, trading_date: str, ticker: str,
+                          integer_prices: bool = False) -> pd.DataFrame:
     messages["timestamp"] = get_timestamps(messages, trading_date)
     messages.drop(["trading_date", "time"], axis=1, inplace=True)
     type_dict = get_external_internal_type_dict()
     messages.message_type.replace(type_dict.keys(), type_dict.values(), inplace=True)
-    messages.price /= 10000
+    if not integer_prices:
+        messages.price /= PRICE_SCALE
     messages['ticker'] = ticker
     update_direction(messages)
     messages.astype({"external_id": int})
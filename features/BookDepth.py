@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+
+from sortedcontainers import SortedDict
+
+from orderbook.Exchange import Exchange
+from orderbook.models import Orderbook
+
+
+class BookDepth:
+    """
+    Aggregated volume of every price level of the exchange's central orderbook, shared by the depth features.
+    It is kept up to date from the level deltas emitted by the exchange, so that an update costs O(changed levels)
+    instead of a pass over the levels and their order queues. It is rebuilt from the book whenever the exchange's book
+    is replaced (episode reset, warm-up cache restore).
+    """
+
+    def __init__(self, exchange: Exchange):
+        self.exchange = exchange
+        self.exchange.track_level_deltas = True
+        self.orderbook: Orderbook = None
+        self.levels: dict = dict(buy=SortedDict(), sell=SortedDict())
+
+    def rebuild(self):
+        self.orderbook = self.exchange.central_orderbook
+        self.levels = dict()
+        for direction in ("buy", "sell"):
+            levels = SortedDict()
+            for price, queue in getattr(self.orderbook, direction).items():
+                volume = sum(order.volume for order in queue)
+                if volume > 0:
+                    levels[price] = volume
+            self.levels[direction] = levels
+        self.exchange.pop_level_deltas()
+
+    def update(self):
+        if self.exchange.central_orderbook is not self.orderbook:
+            self.rebuild()
+            return
+        for (direction, price), delta in self.exchange.pop_level_deltas().items():
+            if delta == 0:
+                continue
+            levels = self.levels[direction]
+            volume = levels.get(price, 0) + delta
+            if volume > 0:
+                levels[price] = volume
+            else:
+                levels.pop(price, None)
+
+    def top_levels(self, direction: str, n_levels: int) -> List[Tuple[int, int]]:
+        """(price, volume) of the n_levels best levels with a positive volume of a side, best first."""
+        levels = self.levels[direction]
+        n_levels = min(n_levels, len(levels))
+        if direction == "buy":
+            return [levels.peekitem(-1 - i) for i in range(n_levels)]
+        return [levels.peekitem(i) for i in range(n_levels)]
+
+
+def get_top_levels(orderbook: Orderbook, direction: str, n_levels: int) -> List[Tuple[int, int]]:
+    """Full pass equivalent of BookDepth.top_levels, for depth features used without a shared BookDepth."""
+    side = getattr(orderbook, direction)
+    prices = reversed(side.keys()) if direction == "buy" else iter(side.keys())
+    top_levels = list()
+    for price in prices:
+        if len(top_levels) == n_levels:
+            break
+        volume = sum(order.volume for order in side[price])
+        if volume > 0:
+            top_levels.append((price, volume))
+    return top_levels
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import math
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from features.Features import (
+    Feature,
+    State,
+    Spread,
+    BookImbalance,
+    Inventory,
+    BuyDistance,
+    SellDistance,
+)
+from features.MarketTracks import MarketTracks
+from features.Normalisers import AffineNormaliser
+from utils.clock import NANOSECONDS_PER_MINUTE
+
+
+# Inputs read once per state and shared by the columnar kernels below
+STATE_INPUTS: dict[str, Callable[[State], float]] = dict(
+    spread=lambda state: state.orderbook.spread,
+    imbalance=lambda state: state.orderbook.imbalance,
+    inventory=lambda state: state.portfolio.inventory,
+    buy_parameter=lambda state: state.buy_parameter or 0,
+    sell_parameter=lambda state: state.sell_parameter or 0,
+)
+
+# Features whose value only depends on the current state, evaluated for all environments at once from the inputs.
+# Each kernel lists its inputs and maps their columns to the feature column.
+KERNELS: dict[type, tuple] = {
+    Spread: (("spread",), lambda spread: spread),
+    BookImbalance: (("imbalance",), lambda imbalance: imbalance),
+    Inventory: (("inventory",), lambda inventory: inventory),
+    BuyDistance: (("buy_parameter", "spread"), lambda parameter, spread: parameter * spread / 2),
+    SellDistance: (("sell_parameter", "spread"), lambda parameter, spread: parameter * spread / 2),
+}
+
+
+class FeatureEngine:
+    """
+    Columnar evaluation of the feature vectors of a batch of environments, each given as its list of features with
+    the same specification. The values, bounds, update frequencies and first usage times are held in arrays of shape
+    (n_envs, n_features), so that the update schedule, the clamping and the observation are a few vectorised
+    operations per step instead of a loop over the features.
+    Features that only read the current state (exactly the types in KERNELS) are computed as columns of the state
+    inputs. Any other Feature subclass is evaluated through an adapter calling its _update, and normalisation still goes
+    through each feature's streaming normaliser, so the values are the same as those of Feature.update.
+    Affine normalisers from precomputed statistics are applied as one vectorised affine transform.
+    With market tracks set, the raw values of the tracked columns are looked up by time instead, and only the other
+    features (typically the agent's Inventory, BuyDistance and SellDistance) are computed live.
+    Given the environments' step size, the update schedule is computed once per episode, when syncing after a reset:
+    the due features of a step only depend on its position in the cycle of steps over which now_is modulo a minute
+    repeats, so each update reads the due mask of its cycle position instead of checking the clock of every feature.
+    Updates must then be called once per step, as the environment does.
+    """
+
+    def __init__(self, features: List[List[Feature]], step_size_ns: Optional[int] = None):
+        self.features = features
+        self.step_size_ns = step_size_ns
+        self.n_envs = len(features)
+        self.n_features = len(features[0])
+        reference = features[0]
+        for env_features in features:
+            assert [self._get_spec(feature) for feature in env_features] == [
+                self._get_spec(feature) for feature in reference
+            ], "Every environment must use the same feature specification."
+        self.min_values = np.array([feature.min_value for feature in reference], dtype=np.float64)
+        self.max_values = np.array([feature.max_value for feature in reference], dtype=np.float64)
+        self.update_frequencies_ns = np.array([feature.update_frequency_ns for feature in reference], dtype=np.int64)
+        self.normalisation_on = np.array([feature.normalisation_on for feature in reference])
+        self.affine = np.array(
+            [feature.normalisation_on and isinstance(feature.normaliser, AffineNormaliser) for feature in reference]
+        )
+        self.affine_scales = np.array([feature.normaliser.scale if affine else 1.0
+                                       for feature, affine in zip(reference, self.affine)])
+        self.affine_offsets = np.array([feature.normaliser.offset if affine else 0.0
+                                        for feature, affine in zip(reference, self.affine)])
+        self.set_tracks(None)
+        self.first_usage_times = np.zeros((self.n_envs, self.n_features), dtype=np.int64)
+        self.values = np.zeros((self.n_envs, self.n_features), dtype=np.float64)
+        self.raw_values = np.zeros((self.n_envs, self.n_features), dtype=np.float64)  # clamped, not normalised
+
+    def set_tracks(self, tracks: Optional[MarketTracks]):
+        self.tracks = tracks
+        tracked = set(tracks.columns) if tracks is not None else set()
+        live = [(j, feature) for j, feature in enumerate(self.features[0]) if j not in tracked]
+        self.kernel_columns = [j for j, feature in live if type(feature) in KERNELS]
+        self.adapter_columns = [j for j, feature in live if type(feature) not in KERNELS]
+        self.inputs = sorted({name for j in self.kernel_columns for name in KERNELS[type(self.features[0][j])][0]})
+
+    def sync(self, states: Optional[List[State]] = None):
+        """Read the values and first usage times back from the features, after they have been reset."""
+        for i, env_features in enumerate(self.features):
+            self.first_usage_times[i] = [feature.first_usage_time for feature in env_features]
+            self.values[i] = [feature.current_value for feature in env_features]
+        if self.tracks is not None and states is not None:
+            self._read_tracks(states, self.values)
+        self.raw_values = self.values.copy()
+        if self.step_size_ns is not None and states is not None:
+            self._schedule(states)
+
+    def get_state(self) -> dict:
+        """The per-episode state of the engine (values and schedule), for the environment's warm-up cache."""
+        names = ("values", "raw_values", "first_usage_times", "cycle", "cycle_all_due", "first_steps", "n_warm_steps",
+                 "n_updates")
+        return {name: getattr(self, name) for name in names if hasattr(self, name)}
+
+    def set_state(self, state: dict):
+        self.__dict__.update(state)
+
+    def update(self, states: List[State]) -> np.ndarray:
+        due, all_due = self._get_due(states)
+        if not all_due and not due.any():
+            return self.values
+        values = self.values.copy()
+        if self.kernel_columns:
+            self._evaluate_kernels(states, values)
+        due_rows = due.tolist()
+        for env_features, state, row, due_row in zip(self.features, states, values, due_rows):
+            for j in self.adapter_columns:
+                if due_row[j]:
+                    feature = env_features[j]
+                    if feature.owns_price_series:  # as in Feature.update, a series not shared by the env is fed here
+                        feature.price_series.push(state.price)
+                    feature._update(state)
+                    row[j] = feature.current_value
+        if self.tracks is not None:
+            self._read_tracks(states, values)
+        clamped = np.minimum(np.maximum(values, self.min_values), self.max_values)
+        clamps = due & (clamped != values)
+        if clamps.any():
+            for i, j in zip(*np.nonzero(clamps)):
+                print(f"Clamping value of {self.features[i][j].name} from {values[i, j]} to {clamped[i, j]}.")
+        self.raw_values = np.where(due, clamped, self.raw_values)
+        if self.affine.any():
+            clamped = np.where(self.affine, clamped * self.affine_scales + self.affine_offsets, clamped)
+        to_normalise = due & self.normalisation_on & ~self.affine
+        if to_normalise.any():
+            for env_features, row, normalise_row in zip(self.features, clamped, to_normalise.tolist()):
+                raw_values = row.tolist()
+                for j, normalise in enumerate(normalise_row):
+                    if normalise:
+                        row[j] = env_features[j].normalise(raw_values[j])
+        self.values = clamped if all_due else np.where(due, clamped, self.values)
+        return self.values
+
+    def _schedule(self, states: List[State]):
+        start = np.array([state.now_is for state in states], dtype=np.int64)[:, None]
+        period = NANOSECONDS_PER_MINUTE // math.gcd(self.step_size_ns, NANOSECONDS_PER_MINUTE)
+        steps = np.arange(1, period + 1, dtype=np.int64)[:, None, None]
+        now_is = start[None] + steps * self.step_size_ns  # (period, n_envs, 1)
+        self.cycle = now_is % NANOSECONDS_PER_MINUTE % self.update_frequencies_ns == 0  # (period, n_envs, n_features)
+        self.cycle_all_due = self.cycle.reshape(period, -1).all(axis=1).tolist()
+        # First step at which now_is >= first_usage_time, for features not yet in use at the start
+        self.first_steps = np.maximum(-((start - self.first_usage_times) // self.step_size_ns), 0)
+        self.n_warm_steps = int(self.first_steps.max())
+        self.n_updates = 0
+
+    def _get_due(self, states: List[State]) -> tuple:
+        if self.step_size_ns is None:
+            now_is = np.fromiter((state.now_is for state in states), dtype=np.int64, count=self.n_envs)[:, None]
+            due = (now_is >= self.first_usage_times) & (
+                now_is % NANOSECONDS_PER_MINUTE % self.update_frequencies_ns == 0
+            )
+            return due, bool(due.all())
+        self.n_updates += 1
+        position = (self.n_updates - 1) % len(self.cycle)
+        if self.n_updates < self.n_warm_steps:
+            due = self.cycle[position] & (self.n_updates >= self.first_steps)
+            return due, bool(due.all())
+        return self.cycle[position], self.cycle_all_due[position]
+
+    def _evaluate_kernels(self, states: List[State], values: np.ndarray):
+        getters = [STATE_INPUTS[name] for name in self.inputs]
+        inputs = np.array([[getter(state) for getter in getters] for state in states], dtype=np.float64)
+        columns = dict(zip(self.inputs, inputs.T))
+        for j in self.kernel_columns:
+            names, kernel = KERNELS[type(self.features[0][j])]
+            values[:, j] = kernel(*(columns[name] for name in names))
+
+    def _read_tracks(self, states: List[State], values: np.ndarray):
+        for row, state in zip(values, states):
+            row[self.tracks.columns] = self.tracks.lookup(state.now_is)
+
+    @staticmethod
+    def _get_spec(feature: Feature) -> tuple:
+        return (type(feature), feature.min_value, feature.max_value, feature.update_frequency_ns,
+                feature.normalisation_on)
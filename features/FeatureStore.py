@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from features.Features import Feature
+from features.MarketTracks import MarketTracks, is_trackable
+from utils.clock import to_datetime
+
+
+class FeatureStore:
+    """
+    On-disk store of market tracks, shared by every process and run using the same trading window and feature
+    specification. A track is saved as a .npy array next to a json header, under
+    path/ticker/day/<step_size_ns>_<spec_hash>, and loaded as a read-only memory map, so that opening it neither
+    copies nor recomputes anything.
+    The tracks hold raw feature values, scaled online by each episode's normalisers, so that they are shared across
+    normalisation settings.
+    """
+
+    def __init__(self, path: str = "feature_store"):
+        self.path = path
+
+    def get_key(self, ticker: str, start: int, end: int, step_size_ns: int, features: List[Feature],
+                integer_prices: bool = False) -> str:
+        spec = [
+            (j, type(feature).__name__, feature.lookback_periods, feature.update_frequency_ns)
+            for j, feature in enumerate(features) if is_trackable(feature, step_size_ns)
+        ]
+        spec_hash = hashlib.sha1(json.dumps([start, end, integer_prices, spec]).encode()).hexdigest()[:16]
+        day = to_datetime(start).strftime("%Y-%m-%d")
+        return os.path.join(ticker, day, f"{step_size_ns}_{spec_hash}")
+
+    def load(self, key: str) -> Optional[MarketTracks]:
+        header_path, values_path = self._get_paths(key)
+        if not (os.path.exists(header_path) and os.path.exists(values_path)):
+            return None
+        with open(header_path) as file:
+            header = json.load(file)
+        values = np.load(values_path, mmap_mode="r")
+        return MarketTracks(header["start"], header["step_size_ns"], header["columns"], values)
+
+    def save(self, key: str, tracks: MarketTracks) -> MarketTracks:
+        """Write the tracks and return them memory-mapped from the store."""
+        header_path, values_path = self._get_paths(key)
+        os.makedirs(os.path.dirname(values_path), exist_ok=True)
+        # Written under temporary names then renamed, so that concurrent runs never read a partial track
+        temporary = f"{values_path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, np.ascontiguousarray(tracks.values))
+        os.replace(temporary, values_path)
+        temporary = f"{header_path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(dict(start=int(tracks.start), step_size_ns=int(tracks.step_size_ns),
+                           columns=[int(column) for column in tracks.columns]), file)
+        os.replace(temporary, header_path)
+        return self.load(key)
+
+    def _get_paths(self, key: str) -> tuple:
+        base = os.path.join(self.path, key)
+        return base + ".json", base + ".npy"
@@ -6,12 +6,15 @@ from datetime import datetime, time, timedelta, date
 
 import numpy as np
 from scipy import stats
-from sklearn.preprocessing import MinMaxScaler, StandardScaler
 import abc
 
+from features.BookDepth import BookDepth, get_top_levels
+from features.Normalisers import Normaliser, NormalisationStatistics, get_normaliser
+from features.PriceSeries import PriceSeries
 from orderbook.models import Orderbook, FilledOrders
+from utils.clock import NANOSECONDS_PER_MINUTE, to_ns
 
-from typing import Optional
+from typing import List, Optional, Tuple
 
 
 class CannotUpdateError(Exception):
@@ -21,7 +24,7 @@ class CannotUpdateError(Exception):
 @dataclass
 class Portfolio:
     inventory: int
-    cash: float
+    cash: float  # in price units: exact ints when the environment runs on integer prices
     gain: float
 
 
@@ -36,7 +39,7 @@ class State:
     orderbook: Orderbook
     price: float #midprice_orderbook
     portfolio: Portfolio
-    now_is: datetime
+    now_is: int  # nanoseconds since epoch
     buy_parameter: int
     sell_parameter: int
 
@@ -51,39 +54,77 @@ class Feature(metaclass=abc.ABCMeta):
         lookback_periods: int,
         normalisation_on: bool,
         max_norm_len: int = 100000,
+        normaliser: str = "min_max",
     ):
         self.name = name
         self.min_value = min_value
         self.max_value = max_value
         assert update_frequency <= timedelta(minutes=1), "HFT update frequency must be less than 1 minute."
         self.update_frequency = update_frequency
+        self.update_frequency_ns = to_ns(update_frequency)
         self.lookback_periods = lookback_periods
         self.normalisation_on = normalisation_on
         self.max_norm_len = max_norm_len
         self.current_value = 0.0
-        self.first_usage_time = datetime.min
-        self.scalar = MinMaxScaler([-1, 1])
+        self.first_usage_time = 0
         if self.normalisation_on:
-            self.history: deque = deque(maxlen=max_norm_len)
+            self.normaliser: Normaliser = get_normaliser(normaliser, max_norm_len)
+        self.price_series: Optional[PriceSeries] = None
+        self.owns_price_series = False
+        if self.price_lookback is not None:
+            self.price_series = PriceSeries(self.update_frequency_ns, self.price_lookback)
+            self.owns_price_series = True
+        self.book_depth: Optional[BookDepth] = None
+
+    @property
+    def price_lookback(self) -> Optional[int]:
+        """Number of trailing returns the feature reads from a price series, None if it does not read one."""
+        return None
+
+    def set_price_series(self, price_series: PriceSeries):
+        """Read the prices from a series shared with other features, which is then updated by its owner."""
+        assert price_series.update_frequency_ns == self.update_frequency_ns, "Price series sampled at another frequency."
+        assert price_series.capacity > self.price_lookback, "Price series shorter than the feature window."
+        self.price_series = price_series
+        self.owns_price_series = False
+
+    @property
+    def depth_levels(self) -> Optional[int]:
+        """Number of price levels per side the feature reads from the book, None if it only reads the best prices."""
+        return None
+
+    def set_book_depth(self, book_depth: BookDepth):
+        """Read the levels from the volumes shared by the depth features, which the environment keeps up to date."""
+        self.book_depth = book_depth
+
+    def _get_top_levels(self, state: State, direction: str) -> List[Tuple[int, int]]:
+        if self.book_depth is not None:
+            return self.book_depth.top_levels(direction, self.depth_levels)
+        return get_top_levels(state.orderbook, direction, self.depth_levels)
 
     @property
     def window_size(self) -> timedelta:
         return self.lookback_periods * self.update_frequency
 
+    @property
+    def window_size_ns(self) -> int:
+        return self.lookback_periods * self.update_frequency_ns
+
     def normalise(self, value: float) -> float:
-        if len(self.history) == 0:
-            # To prevent a Nan value from being returned
-            # if the queue is empty:
-            self.history.append(value + 1e-06)
-        self.history.append(value)
-        return self.scalar.fit_transform(np.array(self.history).reshape(-1, 1)).squeeze()[-1] #StandardScaler().fit_transform(np.array(self.history).reshape(-1, 1)).squeeze()[-1] stats.zscore(self.history)[-1]
+        return self.normaliser.normalise(value)
+
+    def set_normaliser(self, normaliser: str, statistics: Optional[NormalisationStatistics] = None):
+        if self.normalisation_on:
+            self.normaliser = get_normaliser(normaliser, self.max_norm_len, statistics)
 
     @abc.abstractmethod
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         pass
 
     def update(self, state: State) -> None:
         if state.now_is >= self.first_usage_time and self._now_is_multiple_of_update_freq(state.now_is):
+            if self.owns_price_series:
+                self.price_series.push(state.price)
             self._update(state)
             value = self.clamp(self.current_value, min_value=self.min_value, max_value=self.max_value)
             if value != self.current_value:
@@ -94,20 +135,20 @@ class Feature(metaclass=abc.ABCMeta):
     def _update(self, state: State) -> None:
         pass
 
-    def _reset(self, state: State, first_usage_time: Optional[datetime] = None):
-        self.first_usage_time = first_usage_time or datetime.min
+    def _reset(self, state: State, first_usage_time: Optional[int] = None):
+        self.first_usage_time = first_usage_time or 0
         if self.normalisation_on:
-            self.history.clear()
+            self.normaliser.reset()
+        if self.owns_price_series:
+            self.price_series.reset(state.price)
         self._update(state)
 
     @staticmethod
     def clamp(number: float, min_value: float, max_value: float):
         return max(min(number, max_value), min_value)
 
-    def _now_is_multiple_of_update_freq(self, now_is: datetime):
-        return timedelta(seconds=now_is.second, microseconds=now_is.microsecond) % self.update_frequency == timedelta(
-            microseconds=0
-        )
+    def _now_is_multiple_of_update_freq(self, now_is: int):
+        return now_is % NANOSECONDS_PER_MINUTE % self.update_frequency_ns == 0
 
 
 ########################################################################################################################
@@ -126,7 +167,7 @@ class Spread(Feature):
     ):
         super().__init__(name, min_value, max_value, update_frequency, 0, normalisation_on)
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         super()._reset(state, first_usage_time)
 
     def _update(self, state: State) -> None:
@@ -141,7 +182,7 @@ class DeltaMidPrice(Feature):
     ):
         super().__init__("DeltaMidPrice", -1, 1, update_frequency, 0, normalisation_on)
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         super()._reset(state, first_usage_time)
 
     def _update(self, state: State) -> None:
@@ -156,13 +197,123 @@ class BookImbalance(Feature):
     ):
         super().__init__("BookImbalance", -1, 1, update_frequency, 0, normalisation_on)
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         super()._reset(state, first_usage_time)
 
     def _update(self, state: State) -> None:
         self.current_value = state.orderbook.imbalance
 
 
+class MultiLevelImbalance(Feature):
+    """The book imbalance over the n_levels best levels of each side, (bid_volume - ask_volume) / total_volume."""
+
+    def __init__(
+        self,
+        name: str = "MultiLevelImbalance",
+        n_levels: int = 5,
+        update_frequency: timedelta = timedelta(seconds=1),
+        normalisation_on: bool = False,
+    ):
+        self.n_levels = n_levels
+        super().__init__(name, -1, 1, update_frequency, 0, normalisation_on)
+
+    @property
+    def depth_levels(self) -> Optional[int]:
+        return self.n_levels
+
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
+        super()._reset(state, first_usage_time)
+
+    def _update(self, state: State) -> None:
+        buy_volume = sum(volume for _, volume in self._get_top_levels(state, "buy"))
+        sell_volume = sum(volume for _, volume in self._get_top_levels(state, "sell"))
+        total_volume = buy_volume + sell_volume
+        self.current_value = (buy_volume - sell_volume) / total_volume if total_volume > 0 else 0.0
+
+
+class OrderFlowImbalance(Feature):
+    """The order flow imbalance of Cont, Kukanov and Stoikov (2014), summed over the n_levels best levels of each side
+    and over the last lookback_periods updates. At every update, the flow of a level is the bid volume added minus the
+    ask volume added at the i-th best prices, given the i-th best prices and volumes of the previous update."""
+
+    def __init__(
+        self,
+        name: str = "OrderFlowImbalance",
+        n_levels: int = 1,
+        update_frequency: timedelta = timedelta(seconds=1),
+        lookback_periods: int = 10,
+        normalisation_on: bool = False,
+    ):
+        self.n_levels = n_levels
+        super().__init__(name, -1000000, 1000000, update_frequency, lookback_periods, normalisation_on)
+        self.flows: deque = deque(maxlen=self.lookback_periods)
+        self.total_flow = 0
+        self.previous_levels: Optional[dict] = None
+
+    @property
+    def depth_levels(self) -> Optional[int]:
+        return self.n_levels
+
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
+        self.flows = deque(maxlen=self.lookback_periods)
+        self.total_flow = 0
+        self.previous_levels = None
+        super()._reset(state, first_usage_time)
+
+    def _update(self, state: State) -> None:
+        levels = dict(buy=self._get_top_levels(state, "buy"), sell=self._get_top_levels(state, "sell"))
+        flow = 0
+        if self.previous_levels is not None:
+            flow = self._get_flow(levels["buy"], self.previous_levels["buy"], 1)
+            flow -= self._get_flow(levels["sell"], self.previous_levels["sell"], -1)
+        self.previous_levels = levels
+        if len(self.flows) == self.lookback_periods:
+            self.total_flow -= self.flows[0]
+        self.flows.append(flow)
+        self.total_flow += flow
+        self.current_value = self.total_flow
+
+    @staticmethod
+    def _get_flow(levels: List[Tuple[int, int]], previous_levels: List[Tuple[int, int]], sign: int) -> int:
+        """Volume added at the levels of a side, sign being 1 for the bids (higher is better) and -1 for the asks."""
+        flow = 0
+        for (price, volume), (previous_price, previous_volume) in zip(levels, previous_levels):
+            if sign * price >= sign * previous_price:
+                flow += volume
+            if sign * price <= sign * previous_price:
+                flow -= previous_volume
+        return flow
+
+
+class Microprice(Feature):
+    """The volume weighted midprice of the best levels, (ask * bid_volume + bid * ask_volume) / total_volume, relative
+    to the midprice."""
+
+    def __init__(
+        self,
+        name: str = "Microprice",
+        update_frequency: timedelta = timedelta(seconds=1),
+        normalisation_on: bool = False,
+    ):
+        super().__init__(name, -(50 * 100), (50 * 100), update_frequency, 0, normalisation_on)
+
+    @property
+    def depth_levels(self) -> Optional[int]:
+        return 1
+
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
+        super()._reset(state, first_usage_time)
+
+    def _update(self, state: State) -> None:
+        buy_levels, sell_levels = self._get_top_levels(state, "buy"), self._get_top_levels(state, "sell")
+        if not buy_levels or not sell_levels:
+            self.current_value = 0.0
+            return
+        (buy_price, buy_volume), (sell_price, sell_volume) = buy_levels[0], sell_levels[0]
+        microprice = (sell_price * buy_volume + buy_price * sell_volume) / (buy_volume + sell_volume)
+        self.current_value = microprice - (buy_price + sell_price) / 2
+
+
 ########################################################################################################################
 #                                                  Price features                                                      #
 ########################################################################################################################
@@ -183,22 +334,25 @@ class PriceMove(Feature):
         normalisation_on: bool = False,
     ):
         super().__init__(name, min_value, max_value, update_frequency, lookback_periods, normalisation_on)
-        self.prices: deque = deque(maxlen=self.lookback_periods + 1)
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
-        self.prices = deque(maxlen=self.lookback_periods + 1)
+    @property
+    def price_lookback(self) -> Optional[int]:
+        return self.lookback_periods
+
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         super()._reset(state, first_usage_time)
 
     def _update(self, state: State) -> None:
-        self.prices.appendleft(state.price)
-        self.current_value = self.prices[0] - self.prices[-1]
+        prices = self.price_series.price_window(self.lookback_periods + 1)
+        self.current_value = float(prices[-1] - prices[0])
 
 
 class Volatility(Feature):
     """The volatility of the midprice series over a trailing window. We use the variance of percentage returns as
     opposed to the standard deviation of percentage returns as variance scales linearly with time and is therefore more
     reasonably a dimensionless attribute of the returns series. Furthermore, we ignore the mean of the returns since
-    they are too noisy an observation and a *much* larger number of returns is required for it to be useful."""
+    they are too noisy an observation and a *much* larger number of returns is required for it to be useful.
+    The sum of squared returns is rolled forward in O(1) and re-summed once per window to bound rounding drift."""
 
     def __init__(
         self,
@@ -210,26 +364,45 @@ class Volatility(Feature):
         normalisation_on: bool = False,
     ):
         super().__init__(name, min_value, max_value, update_frequency, lookback_periods, normalisation_on)
-        self.prices: deque = deque(maxlen=self.lookback_periods + 1)
+        self._reset_sums()
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
-        self.prices = deque(maxlen=self.lookback_periods + 1)
+    @property
+    def price_lookback(self) -> Optional[int]:
+        return self.lookback_periods
+
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
+        self._reset_sums()
         super()._reset(state, first_usage_time)
 
+    def _reset_sums(self):
+        self.sum_squared_returns = 0.0
+        self.n_moves = 0
+
     def _update(self, state: State) -> None:
-        if len(self.prices) < self.lookback_periods:
-            self.prices.append(state.price)
+        n_returns = self.price_series.n_returns
+        if n_returns > 0:
+            pct_return = self.price_series.last_return
+            self.sum_squared_returns += pct_return**2
+            self.n_moves += pct_return != 0
+            if n_returns > self.lookback_periods:
+                oldest = self.price_series.return_window(self.lookback_periods + 1)[0]
+                self.sum_squared_returns -= oldest**2
+                self.n_moves -= oldest != 0
+            if self.n_moves == 0:
+                self.sum_squared_returns = 0.0
+            elif n_returns % self.lookback_periods == 0:
+                returns = self.price_series.return_window(self.lookback_periods)
+                self.sum_squared_returns = sum(pct_return**2 for pct_return in returns)
+        if n_returns < self.lookback_periods:
             self.current_value = 0.0
-        elif len(self.prices) >= self.lookback_periods:
-            self.prices.append(state.price)
-            pct_returns = np.diff(np.array(self.prices)) / np.array(self.prices)[1:]
-            self.current_value = sum(pct_returns**2) / self.lookback_periods
+        else:
+            self.current_value = self.sum_squared_returns / self.lookback_periods
 
 
 class RSI(Feature):
     """The relative strength index (RSI) is a momentum indicator used in technical analysis, measures the speed and
      magnitude of a security's recent price changes to evaluate overvalued or undervalued conditions
-    in the price of that security"""
+    in the price of that security. The counts and sums of up and down moves are rolled forward in O(1)."""
 
     def __init__(
         self,
@@ -241,25 +414,53 @@ class RSI(Feature):
         normalisation_on: bool = False
     ):
         super().__init__(name, min_value, max_value, update_frequency, lookback_periods, normalisation_on)
-        self.prices: deque = deque(maxlen=self.lookback_periods + 1)
+        self._reset_moves()
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
-        self.prices = deque(maxlen=self.lookback_periods + 1)
+    @property
+    def price_lookback(self) -> Optional[int]:
+        return self.lookback_periods
+
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
+        self._reset_moves()
         super()._reset(state, first_usage_time)
 
+    def _reset_moves(self):
+        self.moves: dict = dict(up=[0, 0.0], down=[0, 0.0])  # [count, sum] of the returns in the window
+
     def _update(self, state: State) -> None:
-        if len(self.prices) < self.lookback_periods:
-            self.prices.append(state.price)
+        n_returns = self.price_series.n_returns
+        if n_returns > 0:
+            self._add_move(self.price_series.last_return, 1)
+            if n_returns > self.lookback_periods:
+                self._add_move(self.price_series.return_window(self.lookback_periods + 1)[0], -1)
+            if n_returns % self.lookback_periods == 0:
+                self._resum_moves()
+        if n_returns < self.lookback_periods:
             self.current_value = 0.0
-        elif len(self.prices) >= self.lookback_periods:
-            self.prices.append(state.price)
-            pct_returns = np.diff(np.array(self.prices)) / np.array(self.prices)[1:]
-            if np.any(np.where(pct_returns > 0)[0]) and np.any(np.where(pct_returns < 0)[0]):
-                avg_up = np.mean(pct_returns[np.where(pct_returns > 0)])
-                avg_down = np.abs(np.mean(pct_returns[np.where(pct_returns < 0)]))
-                self.current_value = 100 * avg_up/(avg_up+avg_down)
-            else:
-                self.current_value = 0
+        elif self._has_recent_move("up") and self._has_recent_move("down"):
+            avg_up = self.moves["up"][1] / self.moves["up"][0]
+            avg_down = abs(self.moves["down"][1] / self.moves["down"][0])
+            self.current_value = 100 * avg_up/(avg_up+avg_down)
+        else:
+            self.current_value = 0
+
+    def _add_move(self, pct_return: float, sign: int):
+        if pct_return != 0:
+            move = self.moves["up" if pct_return > 0 else "down"]
+            move[0] += sign
+            move[1] = move[1] + sign * pct_return if move[0] > 0 else 0.0
+
+    def _resum_moves(self):
+        self._reset_moves()
+        for pct_return in self.price_series.return_window(self.lookback_periods):
+            self._add_move(pct_return, 1)
+
+    def _has_recent_move(self, direction: str) -> bool:
+        # A move that only occurs at the oldest return of the window is not counted, as in the original
+        # np.any(np.where(...)[0]) check which ignored index 0.
+        oldest = self.price_series.return_window(self.lookback_periods)[0]
+        oldest_is_move = oldest > 0 if direction == "up" else oldest < 0
+        return self.moves[direction][0] - oldest_is_move > 0
 
 ########################################################################################################################
 #                                                Order Flow features                                                   #
@@ -284,7 +485,7 @@ class TradeDirectionImbalance(Feature):
         self.total_trades = 0
         self.trade_diff = 0
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         self.trades = dict(buy=deque(maxlen=self.lookback_periods), sell=deque(maxlen=self.lookback_periods))
         self.total_trades = 0
         self.trade_diff = 0
@@ -342,7 +543,7 @@ class TradeVolumeImbalance(Feature):
         self.total_volume = 0
         self.volume_imbalance = 0
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         self.volumes = dict(buy=deque(maxlen=self.lookback_periods), sell=deque(maxlen=self.lookback_periods))
         self.total_volume = 0
         self.volume_imbalance = 0
@@ -398,7 +599,7 @@ class Inventory(Feature):
     ):
         super().__init__(name, min_value, max_value, update_frequency, 0, normalisation_on)
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         super()._reset(state, first_usage_time)
 
     def _update(self, state: State) -> None:
@@ -414,7 +615,7 @@ class SellDistance(Feature):
     ):
         super().__init__(name, 0, 1000000, update_frequency, 0, normalisation_on)
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         super()._reset(state, first_usage_time)
 
     def _update(self, state: State) -> None:
@@ -433,7 +634,7 @@ class BuyDistance(Feature):
     ):
         super().__init__(name, 0, 1000000, update_frequency, 0, normalisation_on)
 
-    def reset(self, state: State, first_usage_time: Optional[datetime] = None):
+    def reset(self, state: State, first_usage_time: Optional[int] = None):
         super()._reset(state, first_usage_time)
 
     def _update(self, state: State) -> None:
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import warnings
+from dataclasses import dataclass
+from typing import Callable, List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from features.Features import (
+    Feature,
+    Spread,
+    DeltaMidPrice,
+    BookImbalance,
+    PriceMove,
+    Volatility,
+    RSI,
+    TradeDirectionImbalance,
+    TradeVolumeImbalance,
+)
+from orderbook.models import Orderbook
+from simulation.OrderbookSimulator import OrderbookSimulator
+
+
+@dataclass
+class MarketInputs:
+    """Market observed at every step of a replay without agent orders, index 0 being the replay start."""
+    start: int  # nanoseconds since epoch
+    step_size_ns: int
+    price: np.ndarray
+    midprice: np.ndarray
+    spread: np.ndarray
+    imbalance: np.ndarray
+    buy_trades: np.ndarray
+    sell_trades: np.ndarray
+    buy_volume: np.ndarray
+    sell_volume: np.ndarray
+
+    @property
+    def returns(self) -> np.ndarray:
+        """Percentage return into every step, (price - previous_price) / price, 0 at the replay start."""
+        returns = np.zeros_like(self.price)
+        returns[1:] = np.diff(self.price) / self.price[1:]
+        return returns
+
+
+@dataclass
+class MarketTracks:
+    """Raw (neither clamped nor normalised) values of the exogenous features at every step of a trading day."""
+    start: int  # nanoseconds since epoch
+    step_size_ns: int
+    columns: List[int]  # feature columns held by the tracks, in the environment's feature order
+    values: np.ndarray  # (n_steps, n_columns)
+
+    def index(self, now_is: int) -> int:
+        index = (now_is - self.start) // self.step_size_ns
+        assert 0 <= index < len(self.values), "Time outside of the market tracks."
+        return index
+
+    def lookup(self, now_is: int) -> np.ndarray:
+        return self.values[self.index(now_is)]
+
+
+def replay_market(
+    simulator: OrderbookSimulator, pricer: Callable[[Orderbook], float], start: int, end: int, step_size_ns: int
+) -> MarketInputs:
+    """
+    Step the simulator from start to end without agent orders, as the warm-up of an episode starting at start does,
+    and record the market inputs of the exogenous features.
+    """
+    n_steps = (end - start) // step_size_ns + 1
+    inputs = {name: np.zeros(n_steps) for name in
+              ("price", "midprice", "spread", "imbalance", "buy_trades", "sell_trades", "buy_volume", "sell_volume")}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        simulator.reset_episode(start_date=start)
+        for step in range(n_steps):
+            if step > 0:
+                filled = simulator.forward_step(until=start + step * step_size_ns, internal_orders=list())
+                for order in filled.external:
+                    inputs[f"{order.direction}_trades"][step] += 1
+                    inputs[f"{order.direction}_volume"][step] += order.volume
+            orderbook = simulator.exchange.central_orderbook
+            inputs["price"][step] = pricer(orderbook)
+            inputs["midprice"][step] = orderbook.midprice
+            inputs["spread"][step] = orderbook.spread
+            inputs["imbalance"][step] = orderbook.imbalance
+    return MarketInputs(start, step_size_ns, **inputs)
+
+
+def compute_market_tracks(features: List[Feature], inputs: MarketInputs) -> MarketTracks:
+    """
+    Vectorised computation of the trackable features over the whole replay. The windows are those of features reset at
+    the replay start, so they are only partial over the first lookback_periods steps.
+    """
+    columns = [j for j, feature in enumerate(features) if is_trackable(feature, inputs.step_size_ns)]
+    values = np.zeros((len(inputs.price), len(columns)))
+    for k, j in enumerate(columns):
+        values[:, k] = TRACK_KERNELS[type(features[j])](features[j], inputs)
+    return MarketTracks(inputs.start, inputs.step_size_ns, columns, values)
+
+
+def is_trackable(feature: Feature, step_size_ns: int) -> bool:
+    """Exogenous features sampled every step, whose value does not depend on the agent."""
+    return (
+        type(feature) in TRACK_KERNELS
+        and feature.update_frequency_ns == step_size_ns
+        and not getattr(feature, "track_internal", False)
+    )
+
+
+def _price_move(feature: PriceMove, inputs: MarketInputs) -> np.ndarray:
+    oldest = np.maximum(np.arange(len(inputs.price)) - feature.lookback_periods, 0)
+    return inputs.price - inputs.price[oldest]
+
+
+def _return_windows(feature: Feature, inputs: MarketInputs) -> np.ndarray:
+    """Windows of the last lookback_periods returns, for the steps lookback_periods onwards."""
+    return sliding_window_view(inputs.returns[1:], feature.lookback_periods)
+
+
+def _volatility(feature: Volatility, inputs: MarketInputs) -> np.ndarray:
+    track = np.zeros(len(inputs.price))
+    if len(inputs.price) > feature.lookback_periods:
+        track[feature.lookback_periods:] = (_return_windows(feature, inputs) ** 2).sum(axis=1) / feature.lookback_periods
+    return track
+
+
+def _rsi(feature: RSI, inputs: MarketInputs) -> np.ndarray:
+    track = np.zeros(len(inputs.price))
+    if len(inputs.price) > feature.lookback_periods:
+        windows = _return_windows(feature, inputs)
+        up, down = windows > 0, windows < 0
+        # As in RSI._update, a move only present at the oldest return of the window does not count
+        has_moves = up[:, 1:].any(axis=1) & down[:, 1:].any(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_up = np.where(up, windows, 0).sum(axis=1) / up.sum(axis=1)
+            avg_down = np.abs(np.where(down, windows, 0).sum(axis=1) / down.sum(axis=1))
+            track[feature.lookback_periods:] = np.where(has_moves, 100 * avg_up / (avg_up + avg_down), 0)
+    return track
+
+
+def _trade_imbalance(buys: np.ndarray, sells: np.ndarray, lookback_periods: int) -> np.ndarray:
+    track = np.zeros(len(buys))
+    if len(buys) > lookback_periods:
+        total = sliding_window_view(buys + sells, lookback_periods)[1:].sum(axis=1)
+        difference = sliding_window_view(buys - sells, lookback_periods)[1:].sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            track[lookback_periods:] = np.where(total != 0, difference / total, 1 / 2)
+    return track
+
+
+TRACK_KERNELS: dict[type, Callable[[Feature, MarketInputs], np.ndarray]] = {
+    Spread: lambda feature, inputs: inputs.spread,
+    DeltaMidPrice: lambda feature, inputs: inputs.midprice,
+    BookImbalance: lambda feature, inputs: inputs.imbalance,
+    PriceMove: _price_move,
+    Volatility: _volatility,
+    RSI: _rsi,
+    TradeDirectionImbalance: lambda feature, inputs: _trade_imbalance(
+        inputs.buy_trades, inputs.sell_trades, feature.lookback_periods
+    ),
+    TradeVolumeImbalance: lambda feature, inputs: _trade_imbalance(
+        inputs.buy_volume, inputs.sell_volume, feature.lookback_periods
+    ),
+}
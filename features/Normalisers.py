@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import abc
+import json
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import numpy as np
+
+
+EPS = np.finfo(np.float64).eps
+
+
+class Normaliser(metaclass=abc.ABCMeta):
+    """Streaming normaliser: maps the newest value of a feature series to its normalised value given the trailing
+    window of the last max_len values, in amortised O(1) per update."""
+
+    def __init__(self, max_len: int = 100000):
+        self.max_len = max_len
+
+    @property
+    def spec(self) -> tuple:
+        return type(self).__name__, self.max_len
+
+    def normalise(self, value: float) -> float:
+        if self.count == 0:
+            # To prevent a Nan value from being returned
+            # if the queue is empty:
+            self._push(value + 1e-06)
+        self._push(value)
+        return self._transform(value)
+
+    @property
+    @abc.abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abc.abstractmethod
+    def reset(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _push(self, value: float) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _transform(self, value: float) -> float:
+        pass
+
+
+class MinMaxNormaliser(Normaliser):
+    """Sliding-window MinMaxScaler([-1, 1]). The window minimum and maximum are tracked with monotonic deques of
+    (index, value) pairs, so that every value is pushed and popped at most once. The result is identical to refitting
+    sklearn's MinMaxScaler on the whole window at every step, including its handling of a near-constant window."""
+
+    def __init__(self, max_len: int = 100000):
+        super().__init__(max_len)
+        self.n_pushed = 0
+        self.n_window = 0
+        self.minima: deque = deque()
+        self.maxima: deque = deque()
+
+    @property
+    def count(self) -> int:
+        return self.n_window
+
+    def reset(self) -> None:
+        self.n_pushed = 0
+        self.n_window = 0
+        self.minima.clear()
+        self.maxima.clear()
+
+    def _push(self, value: float) -> None:
+        value = float(value)
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((self.n_pushed, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((self.n_pushed, value))
+        self.n_pushed += 1
+        oldest_index = self.n_pushed - self.max_len
+        if self.minima[0][0] < oldest_index:
+            self.minima.popleft()
+        if self.maxima[0][0] < oldest_index:
+            self.maxima.popleft()
+        self.n_window = min(self.n_pushed, self.max_len)
+
+    def _transform(self, value: float) -> float:
+        data_min, data_max = self.minima[0][1], self.maxima[0][1]
+        data_range = data_max - data_min
+        if data_range < 10 * EPS:
+            data_range = 1.0
+        scale = 2 / data_range
+        return float(value) * scale + (-1 - data_min * scale)
+
+
+class ZScoreNormaliser(Normaliser):
+    """Sliding-window z-score, equivalent to refitting a StandardScaler on the window at every step. The window mean
+    and sum of squared deviations are maintained with Welford's update, and reversed for the value leaving the
+    window."""
+
+    def __init__(self, max_len: int = 100000):
+        super().__init__(max_len)
+        self.values: deque = deque(maxlen=max_len)
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    @property
+    def count(self) -> int:
+        return len(self.values)
+
+    def reset(self) -> None:
+        self.values.clear()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _push(self, value: float) -> None:
+        value = float(value)
+        if len(self.values) == self.max_len:
+            oldest = self.values[0]
+            delta = oldest - self.mean
+            self.mean -= delta / (self.max_len - 1)
+            self.m2 -= delta * (oldest - self.mean)
+        self.values.append(value)
+        delta = value - self.mean
+        self.mean += delta / len(self.values)
+        self.m2 += delta * (value - self.mean)
+
+    def _transform(self, value: float) -> float:
+        std = np.sqrt(max(self.m2, 0.0) / len(self.values))
+        if std < 10 * EPS:
+            std = 1.0
+        return (float(value) - self.mean) / std
+
+
+class EWZScoreNormaliser(Normaliser):
+    """Exponentially weighted z-score. The mean and variance decay with a half-life of max_len / 10 updates, which
+    trades the exact window semantics for a constant memory footprint."""
+
+    def __init__(self, max_len: int = 100000):
+        super().__init__(max_len)
+        self.alpha = 1 - 0.5 ** (10 / max_len)
+        self.n_pushed = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    @property
+    def count(self) -> int:
+        return self.n_pushed
+
+    def reset(self) -> None:
+        self.n_pushed = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def _push(self, value: float) -> None:
+        value = float(value)
+        if self.n_pushed == 0:
+            self.mean = value
+        else:
+            delta = value - self.mean
+            self.mean += self.alpha * delta
+            self.var = (1 - self.alpha) * (self.var + self.alpha * delta**2)
+        self.n_pushed += 1
+
+    def _transform(self, value: float) -> float:
+        std = np.sqrt(self.var)
+        if std < 10 * EPS:
+            std = 1.0
+        return (float(value) - self.mean) / std
+
+
+@dataclass
+class NormalisationStatistics:
+    """Statistics of the raw (clamped) values of a feature over calibration days."""
+    min: float
+    max: float
+    mean: float
+    std: float
+    lower_quantile: float
+    upper_quantile: float
+
+
+class AffineNormaliser(Normaliser):
+    """Constant affine scaling, value * scale + offset, from precomputed statistics. No history is kept, and every
+    episode (and every replica of a vectorised environment) is scaled the same way."""
+
+    def __init__(self, scale: float, offset: float):
+        super().__init__(0)
+        self.scale = scale
+        self.offset = offset
+
+    @classmethod
+    def from_range(cls, low: float, high: float) -> "AffineNormaliser":
+        """Map [low, high] to [-1, 1], as MinMaxScaler([-1, 1]) fitted on that range would."""
+        data_range = high - low
+        if data_range < 10 * EPS:
+            data_range = 1.0
+        scale = 2 / data_range
+        return cls(scale, -1 - low * scale)
+
+    @property
+    def spec(self) -> tuple:
+        return type(self).__name__, self.scale, self.offset
+
+    @property
+    def count(self) -> int:
+        return 0
+
+    def normalise(self, value: float) -> float:
+        return self._transform(value)
+
+    def reset(self) -> None:
+        pass
+
+    def _push(self, value: float) -> None:
+        pass
+
+    def _transform(self, value: float) -> float:
+        return float(value) * self.scale + self.offset
+
+
+def compute_statistics(
+    values: np.ndarray, names: List[str], quantiles: tuple = (0.01, 0.99)
+) -> dict[str, NormalisationStatistics]:
+    """Per-feature statistics of a (n_steps, n_features) array of raw feature values."""
+    lower, upper = np.quantile(values, quantiles, axis=0)
+    return {
+        name: NormalisationStatistics(
+            float(values[:, j].min()), float(values[:, j].max()), float(values[:, j].mean()),
+            float(values[:, j].std()), float(lower[j]), float(upper[j])
+        )
+        for j, name in enumerate(names)
+    }
+
+
+def save_statistics(statistics: dict[str, NormalisationStatistics], path: str):
+    with open(path, "w") as file:
+        json.dump({name: asdict(feature_statistics) for name, feature_statistics in statistics.items()}, file, indent=2)
+
+
+def load_statistics(path: str) -> dict[str, NormalisationStatistics]:
+    with open(path) as file:
+        return {name: NormalisationStatistics(**feature_statistics) for name, feature_statistics in json.load(file).items()}
+
+
+def get_normaliser(
+    normaliser: str, max_len: int = 100000, statistics: Optional[NormalisationStatistics] = None
+) -> Normaliser:
+    if normaliser.startswith("calibrated"):
+        assert statistics is not None, f"The {normaliser} normaliser needs precomputed statistics."
+    if normaliser == "min_max":
+        return MinMaxNormaliser(max_len)
+    elif normaliser == "z_score":
+        return ZScoreNormaliser(max_len)
+    elif normaliser == "ew_z_score":
+        return EWZScoreNormaliser(max_len)
+    elif normaliser == "calibrated_min_max":
+        return AffineNormaliser.from_range(statistics.min, statistics.max)
+    elif normaliser == "calibrated_quantile":
+        return AffineNormaliser.from_range(statistics.lower_quantile, statistics.upper_quantile)
+    elif normaliser == "calibrated_z_score":
+        std = statistics.std if statistics.std >= 10 * EPS else 1.0
+        return AffineNormaliser(1 / std, -statistics.mean / std)
+    else:
+        raise NotImplementedError(
+            "You must specify one of 'min_max', 'z_score', 'ew_z_score', 'calibrated_min_max', 'calibrated_quantile', "
+            "'calibrated_z_score'"
+        )
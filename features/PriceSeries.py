@@ -0,0 +1,62 @@
+import numpy as np
+
+from utils.clock import NANOSECONDS_PER_MINUTE
+
+
+class PriceSeries:
+    """
+    Trailing prices and percentage returns sampled at a given update frequency, shared by the price features that read
+    their windows from it instead of each keeping its own copy of the series.
+    Like the LagBuffer, values are written twice in buffers of 2 * capacity so that any trailing window is a contiguous
+    view. The capacity is one more than the longest window, so that the value leaving a window can still be read.
+    Returns are computed as (price - previous_price) / price.
+    """
+
+    def __init__(self, update_frequency_ns: int, max_lookback: int):
+        self.update_frequency_ns = update_frequency_ns
+        self.capacity = max_lookback + 1
+        self.prices = np.zeros(2 * self.capacity)
+        self.returns = np.zeros(2 * self.capacity)
+        self.n_prices = 0
+
+    @property
+    def n_returns(self) -> int:
+        return max(self.n_prices - 1, 0)
+
+    @property
+    def last_return(self) -> float:
+        return self.returns[(self.n_prices - 2) % self.capacity]
+
+    def reset(self, price: float):
+        self.n_prices = 0
+        self.push(price)
+
+    def update(self, now_is: int, price: float):
+        if now_is % NANOSECONDS_PER_MINUTE % self.update_frequency_ns == 0:
+            self.push(price)
+
+    def push(self, price: float):
+        if self.n_prices > 0:
+            previous_price = self.prices[(self.n_prices - 1) % self.capacity]
+            self._write(self.returns, self.n_prices - 1, (price - previous_price) / price)
+        self._write(self.prices, self.n_prices, price)
+        self.n_prices += 1
+
+    def price_window(self, n: int) -> np.ndarray:
+        """The last min(n, n_prices) prices, oldest first."""
+        return self._window(self.prices, self.n_prices, n)
+
+    def return_window(self, n: int) -> np.ndarray:
+        """The last min(n, n_returns) returns, oldest first."""
+        return self._window(self.returns, self.n_returns, n)
+
+    def _write(self, buffer: np.ndarray, index: int, value: float):
+        slot = index % self.capacity
+        buffer[slot] = value
+        buffer[slot + self.capacity] = value
+
+    def _window(self, buffer: np.ndarray, count: int, n: int) -> np.ndarray:
+        assert n <= self.capacity, "Window longer than the price series."
+        n = min(n, count)
+        end = (count - 1) % self.capacity + 1 + self.capacity
+        return buffer[end - n:end]
@@ -11,13 +11,23 @@ def add_env_args(parser, ticker: str, dates: list, step_size: float, lags: int,
     parser.add_argument("-mi", "--max_inventory", default=max_inv, help="Maximum (absolute) inventory.", type=int)
     parser.add_argument("-ia", "--inventory_aversion", default=inventry_aversion, help="Inventory aversion.", type=float)
     parser.add_argument("-n", "--normalisation_on", default=True, help="Normalise features.", type=bool)
+    parser.add_argument("-nm", "--normaliser", default="min_max", help="Feature normaliser.",
+                        choices=["min_max", "z_score", "ew_z_score", "calibrated_min_max", "calibrated_quantile",
+                                 "calibrated_z_score"], type=str)
+    parser.add_argument("-nst", "--normalisation_statistics", default=None,
+                        help="Calibrated normalisation statistics (json).", type=str)
+    parser.add_argument("-ar", "--action_repeat", default=1, help="Simulator steps per agent action.", type=int)
+    parser.add_argument("-ip", "--integer_prices", default=False, help="Int LOBSTER price units.", type=bool)
+    parser.add_argument("-mt", "--market_tracks", default=False, help="Precomputed market features.", type=bool)
+    parser.add_argument("-fs", "--feature_store", default=None, help="Market tracks store directory.", type=str)
+    parser.add_argument("-ls", "--lean_step", default=False, help="Lean stepping (StepInfo record as info).", type=bool)
 
     parser.add_argument(
         "-f",
         "--features",
         default="full_state",
-        choices=["agent_state", "market_state", "full_state"],
-        help="Agent state, market state or full state.",
+        choices=["agent_state", "market_state", "full_state", "full_depth_state"],
+        help="Agent state, market state, full state or full state with the multi-level book features.",
         type=str,
     )
     parser.add_argument("-nlf", "--n_lags_feature", default=lags, help="Number of lags per feature", type=int)
@@ -56,12 +66,19 @@ def get_env_configs(args):
         "max_inventory": args["max_inventory"],
         "inventory_aversion": args["inventory_aversion"],
         "normalisation_on": args["normalisation_on"],
+        "normaliser": args["normaliser"],
+        "normalisation_statistics": args["normalisation_statistics"],
         "initial_cash": args["initial_cash"],
         "initial_inventory": args["initial_inventory"],
         "initial_gain": args["initial_gain"],
         "per_step_reward_function": args["per_step_reward_function"],
         "market_order_fraction_of_inventory": args["market_order_fraction_of_inventory"],
-        "n_lags_feature": args["n_lags_feature"]
+        "n_lags_feature": args["n_lags_feature"],
+        "lean_step": args["lean_step"],
+        "action_repeat": args["action_repeat"],
+        "integer_prices": args["integer_prices"],
+        "market_tracks": args["market_tracks"],
+        "feature_store": args["feature_store"]
     }
 
     eval_env_config = deepcopy(env_config)
@@ -1,20 +1,28 @@
 from __future__ import annotations
 
 import warnings
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import sys
 
 from mygym.order_tracking.InfoCalculators import InfoCalculator
 
 if sys.version_info[0] == 3 and sys.version_info[1] >= 8:
-    from typing import List, Literal
+    from typing import Callable, List, Literal, Optional
 else:
-    from typing import List
+    from typing import Callable, List, Optional
     from typing_extensions import Literal
 
 import numpy as np
-from copy import deepcopy
-
+from copy import copy, deepcopy
+
+from database.database_population_helpers import PRICE_SCALE
+from features.BookDepth import BookDepth
+from features.FeatureEngine import FeatureEngine
+from features.FeatureStore import FeatureStore
+from features.Normalisers import NormalisationStatistics
+from features.MarketTracks import MarketTracks, compute_market_tracks, replay_market
+from features.PriceSeries import PriceSeries
 from features.Features import (
     Feature,
     Spread,
@@ -29,13 +37,18 @@ from features.Features import (
     TradeVolumeImbalance,
     RSI,
     BuyDistance,
-    SellDistance
+    SellDistance,
+    MultiLevelImbalance,
+    OrderFlowImbalance,
+    Microprice,
 )
 from mygym.action_interpretation.OrderDistributors import OrderDistributor
+from mygym.observation.LagBuffers import LagBuffer
 from orderbook.create_order import create_order
 from orderbook.models import Order, Orderbook, OrderDict, Cancellation, FilledOrders, MarketOrder
 from rewards.RewardFunctions import RewardFunction, InventoryAdjustedPnL
 from simulation.OrderbookSimulator import OrderbookSimulator
+from utils.clock import to_datetime, to_ns
 
 
 class HistoricalOrderbookEnvironment:
@@ -58,94 +71,258 @@ class HistoricalOrderbookEnvironment:
             normalisation_on: bool = True,
             n_levels: int = 5,
             n_lags_feature: int = 10,
+            lean_step: bool = False,
+            warm_up_cache_size: int = 4,
+            action_repeat: int = 1,
+            integer_prices: bool = False,
+            market_tracks: bool = False,
+            feature_store: FeatureStore = None,
             verbose: bool = False,
     ):
 
         self.ticker = ticker
         self.step_size = step_size
+        self.step_size_ns = to_ns(step_size)
         self.episode_length = episode_length
         self.start_of_trading = start_of_trading
         self.end_of_trading = end_of_trading
+        self.end_of_trading_ns = to_ns(end_of_trading)
         self.initial_portfolio = initial_portfolio or self._get_init_ptf()
-        self.order_distributor = order_distributor or OrderDistributor()
+        self.integer_prices = integer_prices
+        self.price_scale = PRICE_SCALE if integer_prices else 1
+        self.order_distributor = order_distributor or OrderDistributor(integer_prices=integer_prices)
         self.market_order_clearing = market_order_clearing
         self.market_order_fraction_of_inventory = market_order_fraction_of_inventory
         self.per_step_reward_function = per_step_reward_function
         self.n_levels = n_levels
         self.n_lags_feature = n_lags_feature if n_lags_feature==0 else n_lags_feature-1
-        self.info_calculator = info_calculator or InfoCalculator(verbose=verbose)
+        self.info_calculator = info_calculator or InfoCalculator(verbose=verbose, price_scale=self.price_scale)
         self._check_params()
         self.max_inventory = max_inventory
+        self.lean_step = lean_step
+        self.warm_up_cache_size = warm_up_cache_size
+        self.warm_up_cache: OrderedDict = OrderedDict()
+        self.action_repeat = action_repeat
+        assert self.action_repeat >= 1, "An action must be held for at least one simulator step."
+        self.n_resets = 0  # episodes started, with episode_step (agent steps since the reset) the observation position
+        self.episode_step = 0
         self.verbose = verbose
         self.features = features or self.get_default_features(step_size, normalisation_on)
         self.max_feature_window_size = max([feature.window_size for feature in self.features])
+        self.price_series = self._share_price_series()
+        self.feature_engine = FeatureEngine([self.features], self.step_size_ns)
+        self.market_tracks = market_tracks
+        self.tracks: MarketTracks = None
+        self.feature_store = feature_store
         self.simulator = simulator or OrderbookSimulator(
             ticker=ticker,
             n_levels=self.n_levels,
-            verbose=verbose
+            integer_prices=integer_prices,
+            verbose=verbose,
+            quiet=lean_step
         )
+        self.book_depth = self._share_book_depth()
+        assert self.simulator.database.integer_prices == integer_prices, "Database and environment price units differ."
         self.state: State = self._get_default_state()
 
     def reset(self, random_time: bool = None) -> np.ndarray:
         if random_time:
             start_time = self._get_random_start_time()
-            now_is = start_time - (self.max_feature_window_size + self.step_size * self.n_lags_feature)
+            now_is = start_time - self.warm_up_length
             self.terminal_time = start_time + self.episode_length
         else:
-            now_is = self.start_of_trading - (self.max_feature_window_size + self.step_size * self.n_lags_feature)
+            now_is = self.start_of_trading - self.warm_up_length
             self.terminal_time = self.end_of_trading
+        now_is, self.terminal_time_ns = to_ns(now_is), to_ns(self.terminal_time)
+        self.info_calculator.reset_episode(n_steps=(self.terminal_time_ns - now_is) // self.step_size_ns + 1)
+        if self.market_tracks and self.tracks is None:
+            self.tracks = self._build_market_tracks()
+            self.feature_engine.set_tracks(self.tracks)
+        warm_up_key = self._get_warm_up_key(now_is)
+        if warm_up_key in self.warm_up_cache:
+            self._restore_warm_up(warm_up_key)
+        else:
+            self._warm_up(now_is)
+            self._save_warm_up(warm_up_key)
+        self.n_resets += 1
+        self.episode_step = 0
+        return self._get_features() if self.n_lags_feature == 0 else self.lags_feature
+
+    def _warm_up(self, now_is: int):
+        """
+        Replay the market without agent orders until the feature windows and the lag buffer are filled
+        """
         self.simulator.reset_episode(start_date=now_is)
         price = self.pricer(self.central_orderbook)
         self.state = State(FilledOrders(), self.central_orderbook, price, self._get_init_ptf(), now_is, None, None)
         self._reset_features(now_is)
-        self.info_calculator.reset_episode()
-        if self.n_lags_feature > 0: self.lags_feature = np.zeros((self.n_lags_feature+1, len(self.features)))
-        for step in range(int(self.max_feature_window_size / self.step_size) + self.n_lags_feature):
+        if self.n_lags_feature > 0: self.lag_buffer = LagBuffer(self.n_lags_feature + 1, len(self.features))
+        n_warm_up_steps = int(self.max_feature_window_size / self.step_size)
+        # lag rows are pushed every action_repeat steps, as the observations of the episode are
+        for step in range(n_warm_up_steps + self.n_lags_feature * self.action_repeat):
             self._forward(list())
             self._update_features()
-            if self.n_lags_feature > 0:
-                self._set_lags_features(step)
-        return self._get_features() if self.n_lags_feature == 0 else self.lags_feature
+            lag_step = step - (n_warm_up_steps - 1)
+            if self.n_lags_feature > 0 and lag_step >= 0 and lag_step % self.action_repeat == 0:
+                self.lag_buffer.push(self._get_features())
+
+    def _get_warm_up_key(self, now_is: int) -> tuple:
+        """
+        The warm-up only replays historical messages, so its outcome is fully determined by the start time, the
+        stepping and the feature configuration
+        """
+        features_config = tuple(
+            (type(feature).__name__, feature.name, feature.update_frequency, feature.lookback_periods,
+             feature.min_value, feature.max_value, feature.normalisation_on, feature.max_norm_len,
+             feature.normaliser.spec if feature.normalisation_on else None, feature.depth_levels)
+            for feature in self.features
+        )
+        return (self.ticker, now_is, self.step_size, self.n_lags_feature, self.action_repeat, self.market_tracks,
+                features_config)
 
-    def step(self, action: int):
-        done = False
-        internal_orders = self.convert_action_to_orders(action=action)
-        current_state = baseState(price=self.state.price, portfolio=deepcopy(self.state.portfolio))
-        self._forward(internal_orders)
-        self._update_features()
-        next_state = self.state
-        reward = self.per_step_reward_function.calculate(current_state, next_state)
+    @property
+    def warm_up_length(self) -> timedelta:
+        """Time replayed before the start of trading, to fill the feature windows and the lag buffer"""
+        return self.max_feature_window_size + self.step_size * self.n_lags_feature * self.action_repeat
+
+    def _build_market_tracks(self) -> MarketTracks:
+        """
+        Replay the trading window once without agent orders, from the earliest warm-up start, and compute the
+        exogenous features over it, for every episode (random starts included) to look them up by step index.
+        With a feature store, tracks computed by any earlier run are memory-mapped instead.
+        """
+        start = to_ns(self.start_of_trading - self.warm_up_length)
+        if self.feature_store is not None:
+            key = self.feature_store.get_key(self.ticker, start, self.end_of_trading_ns, self.step_size_ns,
+                                             self.features, self.integer_prices)
+            tracks = self.feature_store.load(key)
+            if tracks is not None:
+                return tracks
+        inputs = replay_market(self.simulator, self.pricer, start, self.end_of_trading_ns, self.step_size_ns)
+        tracks = compute_market_tracks(self.features, inputs)
+        if self.feature_store is not None:
+            tracks = self.feature_store.save(key, tracks)
+        return tracks
+
+    def _save_warm_up(self, warm_up_key: tuple):
+        if self.warm_up_cache_size <= 0:
+            return
+        self.warm_up_cache[warm_up_key] = deepcopy((
+            self.simulator.exchange.central_orderbook,
+            self.simulator.exchange.order_id_convertor,
+            self._get_simulator_cursor(),
+            self.state,
+            # The shared BookDepth stays bound to the live exchange, and is rebuilt from the book when restoring
+            [{key: value for key, value in feature.__dict__.items() if key != "book_depth"}
+             for feature in self.features],
+            getattr(self, "lag_buffer", None),
+            self.price_series,
+            self.feature_engine.get_state(),
+        ))
+        if len(self.warm_up_cache) > self.warm_up_cache_size:
+            self.warm_up_cache.popitem(last=False)
+
+    def _restore_warm_up(self, warm_up_key: tuple):
+        self.warm_up_cache.move_to_end(warm_up_key)
+        orderbook, order_id_convertor, cursor, state, features, lag_buffer, price_series, engine = deepcopy(
+            self.warm_up_cache[warm_up_key]
+        )
+        self.simulator.exchange.central_orderbook = orderbook  # state.orderbook is the same object, as after a step
+        self.simulator.exchange.order_id_convertor = order_id_convertor
+        self.simulator.__dict__.update(cursor)
+        self.state = state
+        for feature, feature_dict in zip(self.features, features):
+            feature.__dict__.update(feature_dict)
+        if lag_buffer is not None:
+            self.lag_buffer = lag_buffer
+        self.price_series = price_series  # deep-copied along with the features, so still shared with them
+        self.feature_engine.set_state(engine)
+        if self.book_depth is not None:
+            self.book_depth.rebuild()
+
+    def _get_simulator_cursor(self) -> dict:
+        return dict(
+            now_is=self.simulator.now_is,
+            min_buy_price=self.simulator.min_buy_price,
+            max_sell_price=self.simulator.max_sell_price,
+            initial_buy_price_range=self.simulator.initial_buy_price_range,
+            initial_sell_price_range=self.simulator.initial_sell_price_range,
+        )
+
+    def step(self, action: int, repeat: int = None):
+        """
+        Hold the action for repeat simulator steps (action_repeat by default). Orders and rewards are computed at
+        every simulator step, as if step had been called repeat times, and features keep updating at their own
+        frequency, but the observation (and lag buffer), the info and the summed reward are produced once.
+        """
+        repeat = self.action_repeat if repeat is None else repeat
+        assert repeat >= 1, "An action must be held for at least one simulator step."
+        self.episode_step += 1
+        if self.lean_step:
+            return self._lean_step(action, repeat)
+        reward, done = self._repeat_action(action, repeat, deepcopy)
         features = self.get_features()
-        if self.terminal_time <= next_state.now_is:
-            reward = self.per_step_reward_function.calculate(current_state, next_state)
-            done = True
         info = self.info_calculator.calculate(self.state, reward)
         return features, reward, done, info
 
+    def _lean_step(self, action: int, repeat: int):
+        """
+        Same transition and numbers as the default step, without the per-step bookkeeping: the portfolio snapshot is a
+        shallow copy (it only holds scalars), a quiet simulator (built with quiet=True, as the environment and
+        env_creator do in lean mode) is stepped without entering a warnings context, as it does not issue its warnings
+        about orders missing from the book, and the info is the InfoCalculator's StepInfo record, overwritten in place,
+        instead of a copy of it.
+        """
+        reward, done = self._repeat_action(action, repeat, copy)
+        features = self.get_features()
+        info = self.info_calculator.calculate_record(self.state, reward)
+        return features, reward, done, info
+
+    def _repeat_action(self, action: int, repeat: int, copy_portfolio: Callable[[Portfolio], Portfolio]):
+        reward, done = 0, False
+        for _ in range(repeat):
+            internal_orders = self.convert_action_to_orders(action=action)
+            current_state = baseState(price=self.state.price, portfolio=copy_portfolio(self.state.portfolio))
+            self._forward(internal_orders)
+            self._update_features()
+            reward += self.per_step_reward_function.calculate(current_state, self.state)
+            if self.terminal_time_ns <= self.state.now_is:
+                done = True
+                break
+        return reward / self.price_scale, done  # the agent is rewarded in currency whatever the price units
+
     def _forward(self, internal_orders: List[Order]):
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            filled = self.simulator.forward_step(until=self.state.now_is + self.step_size, internal_orders=internal_orders)
+        if self.lean_step and getattr(self.simulator, "quiet", False):
+            filled = self.simulator.forward_step(until=self.state.now_is + self.step_size_ns, internal_orders=internal_orders)
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                filled = self.simulator.forward_step(until=self.state.now_is + self.step_size_ns, internal_orders=internal_orders)
         self.update_internal_state(filled)
         return filled
 
     def _get_features(self) -> np.ndarray:
-        return np.array([feature.current_value for feature in self.features])
+        return self.feature_engine.values[0].copy()
 
     def get_features(self) -> np.ndarray:
+        """
+        With lags, the observation is a view on the lag buffer, only valid until the next step: copy it to keep it.
+        """
         if self.n_lags_feature == 0:
             return self._get_features()
         else:
-            self.lags_feature[:-1] = self.lags_feature[1:]
-            self.lags_feature[-1] = self._get_features()
-            return self.lags_feature
+            return self.lag_buffer.push(self._get_features())
+
+    @property
+    def lags_feature(self) -> np.ndarray:
+        return self.lag_buffer.window
 
     def update_internal_state(self, filled_orders: FilledOrders):
         self._update_portfolio(filled_orders)
         self.state.filled_orders = filled_orders
         self.state.orderbook = self.central_orderbook
         self.state.price = self.pricer(self.central_orderbook)
-        self.state.now_is += self.step_size
+        self.state.now_is += self.step_size_ns
 
     def convert_action_to_orders(self, action: int) -> List[Order]:
         tetha_sell, tetha_buy, prices = self.order_distributor.convert_action(action, self.state.orderbook)
@@ -155,7 +332,7 @@ class HistoricalOrderbookEnvironment:
             vol = sum(order.volume for order in orders)
             if self.verbose:
                 print(f'{self.state.portfolio.inventory} current inventory')
-                print(f'{orders[0].timestamp} Market order clearing: {orders[0].direction} for a volume of {vol}')
+                print(f'{to_datetime(orders[0].timestamp)} Market order clearing: {orders[0].direction} for a volume of {vol}')
             self.state.buy_parameter = 0
             self.state.sell_parameter = 0
         else:
@@ -168,14 +345,52 @@ class HistoricalOrderbookEnvironment:
     def pricer(orderbook):
         return orderbook.midprice
 
-    def _reset_features(self, episode_start: datetime):
+    def _share_price_series(self) -> dict[int, PriceSeries]:
+        """
+        Price features sampled at the same frequency read their windows from a single price and return series, sized
+        to the longest of their windows, which the environment updates before the features
+        """
+        max_lookbacks: dict[int, int] = dict()
+        for feature in self.features:
+            if feature.price_lookback is not None:
+                max_lookback = max_lookbacks.get(feature.update_frequency_ns, 0)
+                max_lookbacks[feature.update_frequency_ns] = max(max_lookback, feature.price_lookback)
+        price_series = {
+            update_frequency_ns: PriceSeries(update_frequency_ns, max_lookback)
+            for update_frequency_ns, max_lookback in max_lookbacks.items()
+        }
+        for feature in self.features:
+            if feature.price_lookback is not None:
+                feature.set_price_series(price_series[feature.update_frequency_ns])
+        return price_series
+
+    def _share_book_depth(self) -> Optional[BookDepth]:
+        """Depth features read the levels of the book from a single BookDepth, updated from the exchange's level deltas
+        before the features"""
+        if all(feature.depth_levels is None for feature in self.features):
+            return None
+        book_depth = BookDepth(self.simulator.exchange)
+        for feature in self.features:
+            if feature.depth_levels is not None:
+                feature.set_book_depth(book_depth)
+        return book_depth
+
+    def _reset_features(self, episode_start: int):
+        for series in self.price_series.values():
+            series.reset(self.state.price)
+        if self.book_depth is not None:
+            self.book_depth.rebuild()
         for feature in self.features:
-            first_usage_time = episode_start - feature.window_size
+            first_usage_time = episode_start - feature.window_size_ns
             feature.reset(self.state, first_usage_time)
+        self.feature_engine.sync([self.state])
 
     def _update_features(self):
-        for feature in self.features:
-            feature.update(self.state)
+        for series in self.price_series.values():
+            series.update(self.state.now_is, self.state.price)
+        if self.book_depth is not None:
+            self.book_depth.update()
+        self.feature_engine.update([self.state])
 
     def _get_limit_orders(self, prices: dict[str, float], order_volume: int) -> List[Order]:
         orders = list()
@@ -191,7 +406,7 @@ class HistoricalOrderbookEnvironment:
         inventory = self.state.portfolio.inventory
         order_direction = "buy" if inventory < 0 else "sell"
         order_dict = self._get_default_order_dict(order_direction)  # type:ignore
-        order_dict["volume"] = np.round(np.abs(inventory) * self.market_order_fraction_of_inventory)
+        order_dict["volume"] = int(np.round(np.abs(inventory) * self.market_order_fraction_of_inventory))
         market_order = create_order("market", order_dict)
         return [market_order]
 
@@ -217,12 +432,6 @@ class HistoricalOrderbookEnvironment:
     def mark_to_market_value(self):
         return self.state.portfolio.inventory * self.state.price + self.state.portfolio.cash
 
-    def _set_lags_features(self, step):
-        if step == int(self.max_feature_window_size / self.step_size) - 1:
-            self.lags_feature[0] = self._get_features()
-        elif step >= int(self.max_feature_window_size / self.step_size):
-            self.lags_feature[step - int(self.max_feature_window_size / self.step_size) + 1] = self._get_features()
-
     def _get_random_start_time(self):
         return self._random_offset_timestamp()
 
@@ -262,14 +471,19 @@ class HistoricalOrderbookEnvironment:
             orderbook=self.simulator.exchange.get_empty_orderbook(),
             price=0.0,
             portfolio=self.initial_portfolio,
-            now_is=datetime.min,
+            now_is=0,
             buy_parameter=None,
             sell_parameter=None
         )
 
     @staticmethod
-    def get_default_features(step_size: timedelta, normalisation_on: bool = False):
-        return [
+    def get_default_features(
+        step_size: timedelta,
+        normalisation_on: bool = False,
+        normaliser: str = "min_max",
+        statistics: dict[str, NormalisationStatistics] = None,
+    ):
+        features = [
             Spread(
                 update_frequency=step_size,
                 normalisation_on=normalisation_on
@@ -337,4 +551,45 @@ class HistoricalOrderbookEnvironment:
             )
 
         ]
+        for feature in features:
+            feature.set_normaliser(normaliser, (statistics or dict()).get(feature.name))
+        return features
+
+    @staticmethod
+    def get_depth_features(
+        step_size: timedelta,
+        normalisation_on: bool = False,
+        normaliser: str = "min_max",
+        statistics: dict[str, NormalisationStatistics] = None,
+        n_levels: int = 5,
+    ):
+        features = [
+            MultiLevelImbalance(
+                name=f"imbalance_{n_levels}levels",
+                n_levels=n_levels,
+                update_frequency=step_size,
+                normalisation_on=normalisation_on,
+            ),
+            OrderFlowImbalance(
+                name="ofi_1level_10step",
+                n_levels=1,
+                update_frequency=step_size,
+                lookback_periods=10,
+                normalisation_on=normalisation_on,
+            ),
+            OrderFlowImbalance(
+                name=f"ofi_{n_levels}levels_10step",
+                n_levels=n_levels,
+                update_frequency=step_size,
+                lookback_periods=10,
+                normalisation_on=normalisation_on,
+            ),
+            Microprice(
+                update_frequency=step_size,
+                normalisation_on=normalisation_on,
+            ),
+        ]
+        for feature in features:
+            feature.set_normaliser(normaliser, (statistics or dict()).get(feature.name))
+        return features
 
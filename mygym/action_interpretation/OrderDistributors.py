@@ -2,8 +2,9 @@ from orderbook.models import Orderbook
 
 
 class OrderDistributor:
-    def __init__(self, volume: int = 100):
+    def __init__(self, volume: int = 100, integer_prices: bool = False):
         self.volume = volume
+        self.integer_prices = integer_prices
 
     @property
     def limit_orders(self):
@@ -20,6 +21,9 @@ class OrderDistributor:
         distance_sell, distance_buy = self.distance_price(tetha_sell, tetha_buy, spread)
         price_sell = mid_price + distance_sell
         price_buy = mid_price - distance_buy
+        if self.integer_prices:
+            # LOBSTER units: round to the cent tick (100 units) and keep ints so that book keys stay exact
+            return int(round(price_sell, -2)), int(round(price_buy, -2))
         return round(price_sell, 2), round(price_buy, 2)
 
     def convert_action(self, action: int = None, orderbook: Orderbook = None):
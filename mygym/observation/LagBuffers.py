@@ -0,0 +1,35 @@
+import numpy as np
+
+
+class LagBuffer:
+    """
+    Circular buffer holding the last n_lags feature rows, oldest first.
+    Every row is written twice, at its slot and at slot + n_lags, in a buffer of 2 * n_lags rows, so that the ordered
+    window is always the contiguous slice buffer[head:head + n_lags]. Pushing a row therefore costs two row writes and
+    reading the window is a view, whatever the number of lags.
+    The window is only valid until the next push: consumers that keep an observation must copy it.
+    """
+
+    def __init__(self, n_lags: int, n_features: int, dtype: type = np.float64):
+        self.n_lags = n_lags
+        self.n_features = n_features
+        self.buffer = np.zeros((2 * n_lags, n_features), dtype=dtype)
+        self.head = 0
+
+    def reset(self):
+        self.buffer.fill(0)
+        self.head = 0
+
+    def push(self, row: np.ndarray) -> np.ndarray:
+        slot = self.head  # slot of the oldest row, overwritten by the newest one
+        self.buffer[slot] = row
+        self.buffer[slot + self.n_lags] = row
+        self.head = (slot + 1) % self.n_lags
+        return self.window
+
+    @property
+    def window(self) -> np.ndarray:
+        return self.buffer[self.head:self.head + self.n_lags]
+
+    def copy(self) -> np.ndarray:
+        return self.window.copy()
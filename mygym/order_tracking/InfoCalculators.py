@@ -1,12 +1,45 @@
 import abc
+from dataclasses import asdict, dataclass
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 from numpy import ndarray
-from copy import deepcopy
+from copy import copy
 
 from features.Features import State
+from mygym.order_tracking.StepLogs import StepLog
 from rewards.RewardFunctions import RewardFunction
+from utils.clock import to_datetime
+
+
+@dataclass
+class StepInfo:
+    """
+    Per-step info record returned by the lean stepping path. A single instance is allocated per episode and
+    overwritten in place at every step, so callers that keep it across steps must copy it.
+    The timestamp is the simulation clock, in nanoseconds since epoch.
+    """
+    timestamp: int = 0
+    spread: float = 0.0
+    mid_price: float = 0.0
+    tetha_sell: int = 0
+    tetha_buy: int = 0
+    pnl_per_episode: float = 0.0
+    normalised_pnl: float = 0.0
+    inventory: int = 0
+    inventory_ma: float = 0.0
+    aum: float = 0.0
+    filled_buy_price: float = 0.0
+    filled_buy_volume: int = 0
+    filled_sell_price: float = 0.0
+    filled_sell_volume: int = 0
+
+    def to_frame(self) -> pd.DataFrame:
+        """The step info as a one-row DataFrame indexed by the step datetime, built on demand."""
+        info = asdict(self)
+        timestamp = info.pop("timestamp")
+        return pd.DataFrame([info], index=[to_datetime(timestamp)])
 
 
 class _InfoCalculator(metaclass=abc.ABCMeta):
@@ -16,98 +49,164 @@ class _InfoCalculator(metaclass=abc.ABCMeta):
 
 
 class InfoCalculator(_InfoCalculator):
+    STEP_COLUMNS = dict(
+        timestamp=np.int64,
+        mid_price=np.float64,
+        spread=np.float64,
+        tetha_buy=np.int64,
+        tetha_sell=np.int64,
+        pnl=np.float64,
+        inventory=np.int64,
+        aum=np.float64,
+        filled_buy_price=np.float64,
+        filled_buy_volume=np.int64,
+        filled_sell_price=np.float64,
+        filled_sell_volume=np.int64,
+    )
+
     def __init__(
             self,
-            verbose: bool = True
+            verbose: bool = True,
+            price_scale: int = 1,
+            debug_metrics: bool = False,
     ):
+        """
+        price_scale is the number of price units per unit of currency (see HistoricalDatabase): prices and cash coming
+        from the simulation are converted to currency here, the rewards are already in currency.
+        The normalised PnL and mean absolute position are computed from running sums, in O(1) per step. With
+        debug_metrics, they are recomputed from the whole episode's history at every step instead, in O(n).
+        The step history is held in a columnar StepLog, and the per-step info is a StepInfo record.
+        """
         self.verbose = verbose
-
-    def reset_episode(self):
-        self.spreads = []
-        self.inventories = []
-        self.pnls, self.pnl = [], 0
-        self.actions = {'tetha buy': [], 'tetha sell': []}
-        self.filled_actions = deepcopy(self.actions)
-        self.aums, self.aum = [], 0
+        self.price_scale = price_scale
+        self.debug_metrics = debug_metrics
+        self.log = StepLog(self.STEP_COLUMNS)
+
+    def reset_episode(self, n_steps: Optional[int] = None):
+        """n_steps, the expected number of steps of the episode, sizes the step log (which grows if needed)."""
+        self.log.reset(n_steps)
+        self.pnl = 0
+        self.aum = 0
         self.nd_pnl = 0
         self.map = 0
-        self.dates = []
-        self.mid_price = []
-
-    def calculate(self, internal_state: State, reward_relative_midprice: RewardFunction) -> pd.DataFrame:
+        self.n_steps = 0
+        self.spread_sum = 0.0
+        self.abs_inventory_sum = 0
+        self.record = StepInfo()
+
+    def calculate(self, internal_state: State, reward_relative_midprice: RewardFunction) -> StepInfo:
+        """The step info, as a StepInfo record of its own (StepInfo.to_frame gives the former DataFrame)."""
+        return copy(self.calculate_record(internal_state, reward_relative_midprice))
+
+    def calculate_record(self, internal_state: State, reward_relative_midprice: RewardFunction) -> StepInfo:
+        """
+        Same bookkeeping as calculate, but the info is written into the preallocated StepInfo record, overwritten at
+        every step, instead of a new one.
+        """
         self._update_args(reward_relative_midprice)
-        self._update_lists(internal_state)
-        self._update_metrics(internal_state)
-        filled, info = self._compute_filled(internal_state), self._compute_info(internal_state)
-        if self.verbose and np.any(filled!=0):
+        record = self.record
+        record.filled_buy_price, record.filled_buy_volume = 0.0, 0
+        record.filled_sell_price, record.filled_sell_volume = 0.0, 0
+        for order in internal_state.filled_orders.internal:
+            if order.direction == "buy":
+                record.filled_buy_price, record.filled_buy_volume = order.price / self.price_scale, order.volume
+            else:
+                record.filled_sell_price, record.filled_sell_volume = order.price / self.price_scale, order.volume
+        record.timestamp = internal_state.now_is
+        record.spread = internal_state.orderbook.spread / self.price_scale
+        record.mid_price = internal_state.price / self.price_scale
+        record.tetha_sell = internal_state.sell_parameter
+        record.tetha_buy = internal_state.buy_parameter
+        record.pnl_per_episode = (self.pnl - self.log.last("pnl")) if len(self.log) > 0 else self.pnl
+        record.inventory = internal_state.portfolio.inventory
+        self.log.append(
+            record.timestamp, internal_state.orderbook.midprice / self.price_scale, record.spread, record.tetha_buy,
+            record.tetha_sell, self.pnl, record.inventory, self.calculate_aum(internal_state), record.filled_buy_price,
+            record.filled_buy_volume, record.filled_sell_price, record.filled_sell_volume,
+        )
+        self._update_metrics(record.spread, record.inventory)
+        record.normalised_pnl = self.nd_pnl
+        record.inventory_ma = self.map
+        record.aum = self.aum
+        if self.verbose and (record.filled_buy_volume != 0 or record.filled_sell_volume != 0):
             print('*' * 50)
-            print(filled)
-            print('\n')
-            print(info.T)
+            print(record)
             print('*' * 50)
-        return info
+        return record
+
+    def to_frame(self) -> pd.DataFrame:
+        """The episode's step history as a DataFrame indexed by the step datetimes, built on demand."""
+        return self.log.to_frame(index=self.dates)
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        """
+        Step timestamps as datetimes, built on demand from the integer simulation clock for reporting
+        """
+        return pd.to_datetime(self.timestamps, unit="ns")
+
+    @property
+    def timestamps(self) -> ndarray:
+        return self.log["timestamp"]
+
+    @property
+    def mid_price(self) -> ndarray:
+        return self.log["mid_price"]
+
+    @property
+    def spreads(self) -> ndarray:
+        return self.log["spread"]
+
+    @property
+    def inventories(self) -> ndarray:
+        return self.log["inventory"]
+
+    @property
+    def pnls(self) -> ndarray:
+        return self.log["pnl"]
+
+    @property
+    def aums(self) -> ndarray:
+        return self.log["aum"]
+
+    @property
+    def actions(self) -> dict:
+        return {'tetha buy': self.log["tetha_buy"], 'tetha sell': self.log["tetha_sell"]}
+
+    @property
+    def filled_actions(self) -> dict:
+        """
+        Parameters of the steps with a fill (or with market orders only), -1 standing for the side that was not filled
+        """
+        tetha_buy, tetha_sell = self.log["tetha_buy"], self.log["tetha_sell"]
+        buy_filled, sell_filled = self.log["filled_buy_volume"] != 0, self.log["filled_sell_volume"] != 0
+        market_only = (tetha_buy == 0) & (tetha_sell == 0)
+        steps = market_only | buy_filled | sell_filled
+        return {
+            'tetha buy': np.where(market_only | buy_filled, tetha_buy, -1)[steps],
+            'tetha sell': np.where(market_only | sell_filled, tetha_sell, -1)[steps],
+        }
 
     def _update_args(self, reward_relative_midprice: RewardFunction):
         self.pnl += reward_relative_midprice
 
-    def _update_lists(self, internal_state: State):
-        self.mid_price.append(internal_state.orderbook.midprice)
-        self.spreads.append(internal_state.orderbook.spread)
-        self.inventories.append(internal_state.portfolio.inventory)
-        self.pnls.append(self.pnl)
-        self.dates.append(internal_state.now_is)
-        self.actions['tetha buy'].append(internal_state.buy_parameter)
-        self.actions['tetha sell'].append(internal_state.sell_parameter)
-
-    def _update_metrics(self, internal_state: State):
+    def _update_metrics(self, spread: float, inventory: int):
+        self.n_steps += 1
+        self.spread_sum += spread
+        self.abs_inventory_sum += abs(inventory)
         self.nd_pnl = self.calculate_nd_pnl()
         self.map = self.calculate_map()
-        self.aum = self.calculate_aum(internal_state)
-        self.aums.append(self.aum)
-
-    def _compute_filled(self, internal_state: State) -> pd.DataFrame:
-        col = [["buy", "sell"], ["price", "volume"]]
-        date = internal_state.filled_orders.internal[0].timestamp if len(
-            internal_state.filled_orders.internal) > 0 else None
-        index = pd.MultiIndex.from_product(col, names=[date, ""])
-        filled = pd.DataFrame(np.zeros((4, 1)), index=index, columns=["agent's filled orders"])
-        for order in internal_state.filled_orders.internal:
-            filled.loc[order.direction] = np.array([order.price, order.volume]).reshape(-1, 1)
-        if internal_state.buy_parameter == 0 and internal_state.sell_parameter == 0:
-            self.filled_actions['tetha buy'].append(internal_state.buy_parameter)
-            self.filled_actions['tetha sell'].append(internal_state.sell_parameter)
-        elif np.any(filled.loc["buy"]!=0) and np.any(filled.loc["sell"]!=0):
-            self.filled_actions['tetha buy'].append(internal_state.buy_parameter)
-            self.filled_actions['tetha sell'].append(internal_state.sell_parameter)
-        elif np.any(filled.loc["buy"]!=0) and np.any(filled.loc["sell"]==0):
-            self.filled_actions['tetha buy'].append(internal_state.buy_parameter)
-            self.filled_actions['tetha sell'].append(-1)
-        elif np.any(filled.loc["buy"]==0) and np.any(filled.loc["sell"]!=0):
-            self.filled_actions['tetha buy'].append(-1)
-            self.filled_actions['tetha sell'].append(internal_state.sell_parameter)
-        return filled
-
-    def _compute_info(self, internal_state: State) -> pd.DataFrame:
-        pnl_mp_pe = (self.pnls[-1]-self.pnls[-2]) if len(self.pnls)>1 else self.pnls[0]
-        info_dict = dict(
-            spread=internal_state.orderbook.spread,
-            mid_price=internal_state.price,
-            tetha_sell=internal_state.sell_parameter,
-            tetha_buy=internal_state.buy_parameter,
-            pnl_per_episode=pnl_mp_pe,
-            normalised_pnl=self.nd_pnl,
-            inventory=self.inventories[-1],
-            inventory_ma=self.map,
-            aum=self.aum,
-        )
-        info = pd.DataFrame([info_dict], index=[internal_state.now_is])
-        return info
+        self.aum = self.log.last("aum")
 
     def calculate_aum(self, internal_state: State) -> float:
-        return internal_state.portfolio.cash + internal_state.price * internal_state.portfolio.inventory
+        return (internal_state.portfolio.cash + internal_state.price * internal_state.portfolio.inventory) / self.price_scale
 
     def calculate_nd_pnl(self) -> float:
-        return self.pnl / np.mean(self.spreads)
+        if self.debug_metrics:
+            return self.pnl / np.mean(self.spreads)
+        return self.pnl / (self.spread_sum / self.n_steps)
 
     def calculate_map(self) -> ndarray:
-        return np.mean(np.abs(self.inventories))
\ No newline at end of file
+        if self.debug_metrics:
+            return np.mean(np.abs(self.inventories))
+        return self.abs_inventory_sum / self.n_steps
@@ -0,0 +1,52 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class StepLog:
+    """
+    Columnar log of per-step values, one typed NumPy column per field. The columns are preallocated to the expected
+    number of steps of the episode and doubled when full, so that logging a step is a few scalar writes instead of
+    appending boxed values to Python lists.
+    Columns are read as views of the logged steps, only valid until the next reset, and DataFrames are only built on
+    demand.
+    """
+
+    def __init__(self, columns: dict, capacity: int = 1024):
+        self.dtypes = columns
+        self.names = list(columns)
+        self.reset(capacity)
+
+    def reset(self, capacity: Optional[int] = None):
+        """Start a new log, in new arrays so that views of the previous one stay valid."""
+        self.capacity = max(int(capacity or 1024), 1)
+        self.arrays = [np.zeros(self.capacity, dtype=dtype) for dtype in self.dtypes.values()]
+        self.n_steps = 0
+
+    def append(self, *row):
+        """Log a step, given its values in the order of the columns."""
+        if self.n_steps == self.capacity:
+            self._grow()
+        for array, value in zip(self.arrays, row):
+            array[self.n_steps] = value
+        self.n_steps += 1
+
+    def __len__(self) -> int:
+        return self.n_steps
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[self.names.index(name)][:self.n_steps]
+
+    def last(self, name: str, lag: int = 0):
+        return self.arrays[self.names.index(name)][self.n_steps - 1 - lag]
+
+    def to_frame(self, index: Optional[pd.Index] = None) -> pd.DataFrame:
+        return pd.DataFrame({name: array[:self.n_steps] for name, array in zip(self.names, self.arrays)}, index=index)
+
+    def _grow(self):
+        self.capacity *= 2
+        for k, array in enumerate(self.arrays):
+            grown = np.zeros(self.capacity, dtype=array.dtype)
+            grown[:self.n_steps] = array[:self.n_steps]
+            self.arrays[k] = grown
@@ -6,6 +6,8 @@ from mygym.HistoricalOrderbookEnvironment import HistoricalOrderbookEnvironment
 from rewards.RewardFunctions import InventoryAdjustedPnL, PnL
 
 from features.Features import Portfolio
+from features.FeatureStore import FeatureStore
+from features.Normalisers import compute_statistics, load_statistics, save_statistics
 
 from pylab import plt
 import pandas as pd
@@ -25,29 +27,52 @@ def get_reward_function(reward_function: str, inventory_aversion: float = 0.1):
 
 
 def env_creator(env_config):
-    database = HistoricalDatabase(ticker=env_config["ticker"])
+    database = HistoricalDatabase(ticker=env_config["ticker"], integer_prices=env_config.get("integer_prices", False))
+    statistics = load_statistics(env_config["normalisation_statistics"]) \
+        if env_config.get("normalisation_statistics") else None
 
     if env_config["features"] == "agent_state":
         features = HistoricalOrderbookEnvironment.get_default_features(
             step_size=timedelta(seconds=env_config["step_size"]),
             normalisation_on=env_config["normalisation_on"],
+            normaliser=env_config.get("normaliser", "min_max"),
+            statistics=statistics,
         )[-3:]
 
     elif env_config["features"] == "market_state":
         features = HistoricalOrderbookEnvironment.get_default_features(
             step_size=timedelta(seconds=env_config["step_size"]),
             normalisation_on=env_config["normalisation_on"],
+            normaliser=env_config.get("normaliser", "min_max"),
+            statistics=statistics,
         )[:-3]
 
     elif env_config["features"] == "full_state":
         features = HistoricalOrderbookEnvironment.get_default_features(
             step_size=timedelta(seconds=env_config["step_size"]),
             normalisation_on=env_config["normalisation_on"],
+            normaliser=env_config.get("normaliser", "min_max"),
+            statistics=statistics,
+        )
+
+    elif env_config["features"] == "full_depth_state":
+        features = HistoricalOrderbookEnvironment.get_default_features(
+            step_size=timedelta(seconds=env_config["step_size"]),
+            normalisation_on=env_config["normalisation_on"],
+            normaliser=env_config.get("normaliser", "min_max"),
+            statistics=statistics,
+        )
+        features[-3:-3] = HistoricalOrderbookEnvironment.get_depth_features(
+            step_size=timedelta(seconds=env_config["step_size"]),
+            normalisation_on=env_config["normalisation_on"],
+            normaliser=env_config.get("normaliser", "min_max"),
+            statistics=statistics,
         )
 
     orderbook_simulator = OrderbookSimulator(
         ticker=env_config["ticker"],
         database=database,
+        quiet=env_config.get("lean_step", False),
     )
     env = HistoricalOrderbookEnvironment(
         start_of_trading=env_config["start_trading"],
@@ -62,11 +87,35 @@ def env_creator(env_config):
                                     gain=env_config["initial_gain"]),
         per_step_reward_function=get_reward_function(env_config["per_step_reward_function"],
                                                      env_config["inventory_aversion"]),
-        n_lags_feature=env_config["n_lags_feature"]
+        n_lags_feature=env_config["n_lags_feature"],
+        lean_step=env_config.get("lean_step", False),
+        action_repeat=env_config.get("action_repeat", 1),
+        integer_prices=env_config.get("integer_prices", False),
+        market_tracks=env_config.get("market_tracks", False),
+        feature_store=FeatureStore(env_config["feature_store"]) if env_config.get("feature_store") else None
     )
     return env
 
 
+def calibrate_normalisation(env_configs: list, path: str, n_actions: int = 9, quantiles: tuple = (0.01, 0.99)):
+    """
+    Calibration pass for the calibrated normalisers: run one episode with random actions on each training window and
+    save the statistics of the raw (clamped, not normalised) feature values to path
+    """
+    values = list()
+    for env_config in env_configs:
+        env = env_creator(env_config)
+        env.reset()
+        values.append(env.feature_engine.raw_values[0].copy())
+        done = False
+        while not done:
+            _, _, done, _ = env.step(np.random.randint(n_actions))
+            values.append(env.feature_engine.raw_values[0].copy())
+    statistics = compute_statistics(np.array(values), [feature.name for feature in env.features], quantiles)
+    save_statistics(statistics, path)
+    return statistics
+
+
 def done_inf(dct):
     df = pd.DataFrame.from_dict(dct, orient='index').T
     df.index = list(df.index + 1)
@@ -91,35 +140,35 @@ def plot_per_episode(
     def join_df(step_info_per_episode, step_info_per_eval_episode, train_metric, val_metric):
         if step_info_per_episode is not None:
             train_metric = pd.DataFrame([train_metric], index=['training'],
-                                        columns=step_info_per_episode.__dict__['dates'][-len(train_metric):]).T
+                                        columns=step_info_per_episode.dates[-len(train_metric):]).T
             val_metric = pd.DataFrame([val_metric], index=['testing'],
-                                      columns=step_info_per_eval_episode.__dict__['dates'][-len(val_metric):]).T
+                                      columns=step_info_per_eval_episode.dates[-len(val_metric):]).T
             metrics = pd.concat([train_metric, val_metric])
             assert (len(metrics.T) == 2)
             assert (len(metrics) == (len(train_metric) + len(val_metric)))
         else:
             train_metric = pd.DataFrame()
             val_metric = pd.DataFrame([val_metric], index=['testing'],
-                                      columns=step_info_per_eval_episode.__dict__['dates'][-len(val_metric):]).T
+                                      columns=step_info_per_eval_episode.dates[-len(val_metric):]).T
             metrics = val_metric
         return train_metric, val_metric, metrics
 
     def graph_per_episode(step_info_per_episode, step_info_per_eval_episode, metric: str = None):
-        train_metric = step_info_per_episode.__dict__[metric] if step_info_per_episode is not None else None
-        val_metric = step_info_per_eval_episode.__dict__[metric]
+        train_metric = getattr(step_info_per_episode, metric) if step_info_per_episode is not None else None
+        val_metric = getattr(step_info_per_eval_episode, metric)
         _, _, metrics = join_df(step_info_per_episode, step_info_per_eval_episode, train_metric, val_metric)
         return metrics
 
     def info_metrics(step_info_per_episode, step_info_per_eval_episode, window: str = '10s'):
-        train_reward = np.diff(step_info_per_episode.__dict__['pnls']) if step_info_per_episode is not None else None
-        val_reward = np.diff(step_info_per_eval_episode.__dict__['pnls'])
+        train_reward = np.diff(step_info_per_episode.pnls) if step_info_per_episode is not None else None
+        val_reward = np.diff(step_info_per_eval_episode.pnls)
         train_reward, test_reward, rewards = join_df(step_info_per_episode, step_info_per_eval_episode, train_reward,
                                                      val_reward)
-        train_aum = step_info_per_episode.__dict__['aums'] if step_info_per_episode is not None else None
-        val_aum = step_info_per_eval_episode.__dict__['aums']
+        train_aum = step_info_per_episode.aums if step_info_per_episode is not None else None
+        val_aum = step_info_per_eval_episode.aums
         train_aum, test_aum, aums = join_df(step_info_per_episode, step_info_per_eval_episode, train_aum, val_aum)
-        train_inv = step_info_per_episode.__dict__['inventories'] if step_info_per_episode is not None else None
-        val_inv = step_info_per_eval_episode.__dict__['inventories']
+        train_inv = step_info_per_episode.inventories if step_info_per_episode is not None else None
+        val_inv = step_info_per_eval_episode.inventories
         train_inv, test_inv, invs = join_df(step_info_per_episode, step_info_per_eval_episode, train_inv, val_inv)
         map_roll = pd.concat([train_inv.abs().rolling(1).mean(),
                               test_inv.abs().rolling(1).mean()]).dropna(how='all')
@@ -130,25 +179,25 @@ def plot_per_episode(
         return stats, rewards, aum_map
 
     def info_actions(step_info_per_episode, step_info_per_eval_episode):
-        actions_train = pd.DataFrame.from_dict(step_info_per_episode.__dict__['actions'],
+        actions_train = pd.DataFrame.from_dict(step_info_per_episode.actions,
                                                orient='index').T if step_info_per_episode is not None else pd.DataFrame()
-        actions_test = pd.DataFrame.from_dict(step_info_per_eval_episode.__dict__['actions'], orient='index').T
+        actions_test = pd.DataFrame.from_dict(step_info_per_eval_episode.actions, orient='index').T
         return actions_train.value_counts(), actions_test.value_counts()
 
     def info_factions(step_info_per_episode, step_info_per_eval_episode):
-        actions_train = pd.DataFrame.from_dict(step_info_per_episode.__dict__['filled_actions'],
+        actions_train = pd.DataFrame.from_dict(step_info_per_episode.filled_actions,
                                                orient='index').T if step_info_per_episode is not None else pd.DataFrame()
         factions_train = actions_train[actions_train != -1][actions_train != 0].dropna()
         factions_train_ = actions_train[(actions_train == -1).sum(axis=1).astype('bool')]
-        actions_test = pd.DataFrame.from_dict(step_info_per_eval_episode.__dict__['filled_actions'], orient='index').T
+        actions_test = pd.DataFrame.from_dict(step_info_per_eval_episode.filled_actions, orient='index').T
         factions_test = actions_test[actions_test != -1][actions_test != 0].dropna()
         factions_test_ = actions_test[(actions_test == -1).sum(axis=1).astype('bool')]
         return factions_train.value_counts(), factions_train_.value_counts(), factions_test.value_counts(), factions_test_.value_counts()
 
     def uncertainties_aum_map(step_info):
-        cols = step_info.__dict__['dates'][1:]
-        aum = pd.Series(np.diff(step_info.__dict__['aums']), index=cols)
-        inventories = pd.Series(np.diff(step_info.__dict__['inventories']), index=cols)
+        cols = step_info.dates[1:]
+        aum = pd.Series(np.diff(step_info.aums), index=cols)
+        inventories = pd.Series(np.diff(step_info.inventories), index=cols)
         map = inventories.abs()
 
         uncertainties = pd.DataFrame(index=['PnL', 'MAP'],
@@ -40,12 +40,15 @@ class Exchange:
     ticker: str = "MSFT"
     central_orderbook: Orderbook = None  # type: ignore
     max_levels: int = 1e10
+    track_level_deltas: bool = False  # record the volume added or removed per level, for the book depth features
+    quiet: bool = False  # do not warn about orders missing from the book
 
     def __post_init__(self):
         self.central_orderbook = self.central_orderbook or self.get_empty_orderbook()
         assert self.central_orderbook.ticker == self.ticker, "Orderbook ticker must agree with the exchange ticker."
         self.order_id_convertor = OrderIdConvertor()
         self.name = "NASDAQ"
+        self.level_deltas: dict = dict()
 
     def process_order(self, order: Order) -> Optional[FilledOrders]:
         if hasattr(order, "volume") and order.volume is not None:
@@ -64,6 +67,8 @@ class Exchange:
         if self._does_order_cross_spread(order):
             return self.execute_order(order)  # Execute against orders already in the book
         order = self.order_id_convertor.add_internal_id_to_order_and_track(order)
+        if self.track_level_deltas:
+            self._record_level_delta(order.direction, order.price, order.volume)
         try:
             getattr(self.central_orderbook, order.direction)[order.price].append(order)
         except KeyError:
@@ -128,6 +133,19 @@ class Exchange:
             self._reduce_order_with_queue_position(order, queue_position, volume_to_remove, self.central_orderbook)
         return None
 
+    def set_level(self, order: LimitOrder) -> None:
+        """Replace the whole price level of the order by the order alone."""
+        side = getattr(self.central_orderbook, order.direction)
+        if self.track_level_deltas:
+            removed_volume = sum(level_order.volume for level_order in side.get(order.price, ()))
+            self._record_level_delta(order.direction, order.price, order.volume - removed_volume)
+        side[order.price] = deque([order])
+
+    def pop_level_deltas(self) -> dict:
+        """Net volume added (positive) or removed (negative) per (direction, price) level since the last call."""
+        level_deltas, self.level_deltas = self.level_deltas, dict()
+        return level_deltas
+
     def get_empty_orderbook(self):
         return Orderbook(buy=SortedDict(), sell=SortedDict(), ticker=self.ticker)
 
@@ -189,7 +207,7 @@ class Exchange:
         if internal_id is None and order.is_external:  # This is due to the external order being submitted before start
             return None
         if order.price not in getattr(orderbook, order.direction):
-            warnings.warn(f"No {order.direction} orders found at level {order.price}")
+            if not self.quiet: warnings.warn(f"No {order.direction} orders found at level {order.price}")
             return None
         book_level = getattr(orderbook, order.direction)[order.price]
         left, right = 0, len(book_level) - 1
@@ -202,7 +220,7 @@ class Exchange:
                 left = middle + 1
             elif middle_id > internal_id:  # type: ignore
                 right = middle - 1
-        warnings.warn(f"No order found with internal_id = {internal_id}")
+        if not self.quiet: warnings.warn(f"No order found with internal_id = {internal_id}")
         return None
 
     def _reduce_order_with_queue_position(
@@ -219,11 +237,17 @@ class Exchange:
             )
         removed_order = deepcopy(getattr(orderbook, order.direction)[order.price][queue_position])
         removed_order.volume = volume_to_remove
+        if self.track_level_deltas and orderbook is self.central_orderbook:
+            self._record_level_delta(order.direction, order.price, -volume_to_remove)
         order_to_partially_remove.volume -= volume_to_remove
         getattr(orderbook, order.direction)[order.price][queue_position] = order_to_partially_remove
         self._clear_empty_orders_and_prices(order.price, order.direction, queue_position, orderbook)
         return removed_order
 
+    def _record_level_delta(self, direction: Literal["buy", "sell"], price: int, volume: int):
+        key = (direction, price)
+        self.level_deltas[key] = self.level_deltas.get(key, 0) + volume
+
     def _clear_empty_orders_and_prices(
         self, price: int, direction: Literal["buy", "sell"], queue_position: int, orderbook: Orderbook
     ):
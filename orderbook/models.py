@@ -9,7 +9,6 @@ else:
     from typing_extensions import Literal, TypedDict
 
 from dataclasses import dataclass, field
-from datetime import datetime
 from sortedcontainers.sorteddict import SortedDict
 
 
@@ -17,7 +16,7 @@ from sortedcontainers.sorteddict import SortedDict
 class Order:
     """Base class for Orders."""
 
-    timestamp: datetime
+    timestamp: int  # nanoseconds since epoch, as the simulation clock
     direction: Literal["buy", "sell"]
     ticker: str
     internal_id: Optional[int]
@@ -96,7 +95,7 @@ class Orderbook:
 
 
 class OrderDict(TypedDict):
-    timestamp: datetime
+    timestamp: int
     price: Optional[float]
     volume: Optional[int]
     direction: Literal["buy", "sell"]
@@ -8,6 +8,7 @@ import pandas as pd
 from database.HistoricalDatabase import HistoricalDatabase
 from orderbook.create_order import create_order
 from orderbook.models import Order
+from utils.clock import to_ns
 
 
 class HistoricalOrderGenerator:
@@ -16,13 +17,15 @@ class HistoricalOrderGenerator:
     def __init__(
         self,
         ticker: str = "MSFT",
-        database: HistoricalDatabase = None
+        database: HistoricalDatabase = None,
+        quiet: bool = False
     ):
         self.ticker = ticker
         self.database = database or HistoricalDatabase()
         self.exchange_name = "NASDAQ"  # Here, we are only using LOBSTER data for now
+        self.quiet = quiet
 
-    def generate_orders(self, start_date: datetime, end_date: datetime) -> Deque[Order]:
+    def generate_orders(self, start_date: int, end_date: int) -> Deque[Order]:
         messages = self.database.get_messages(start_date, end_date, self.ticker)
         messages = self._process_messages_and_add_internal(messages)
         if len(messages) == 0:
@@ -31,9 +34,9 @@ class HistoricalOrderGenerator:
             return deque(messages.internal_message)
 
     @staticmethod
-    def _remove_hidden_executions(messages: pd.DataFrame):
+    def _remove_hidden_executions(messages: pd.DataFrame, quiet: bool = False):
         if messages.empty:
-            warnings.warn("DataFrame is empty.")
+            if not quiet: warnings.warn("DataFrame is empty.")
             return messages
         else:
             assert (
@@ -46,7 +49,7 @@ class HistoricalOrderGenerator:
         return (max(datetime_1, datetime_2) - min(datetime_1, datetime_2)) / 2 + min(datetime_1, datetime_2)
 
     def _process_messages_and_add_internal(self, messages: pd.DataFrame):
-        messages = self._remove_hidden_executions(messages)  #
+        messages = self._remove_hidden_executions(messages, self.quiet)  #
         internal_messages = messages.apply(get_order_from_external_message, axis=1).values
         if len(internal_messages) > 0:
             messages = messages.assign(internal_message=internal_messages)
@@ -57,7 +60,7 @@ def get_order_from_external_message(message: pd.Series):
     return create_order(
         order_type=message.message_type,
         order_dict=dict(
-            timestamp=message.timestamp,
+            timestamp=to_ns(message.timestamp),
             price=message.price,
             volume=message.volume,
             direction=message.direction,
@@ -1,5 +1,4 @@
 import sys
-from collections import deque
 from datetime import datetime, timedelta
 
 if sys.version_info[0] == 3 and sys.version_info[1] >= 8:
@@ -15,6 +14,7 @@ from database.HistoricalDatabase import HistoricalDatabase
 from orderbook.models import Orderbook, Order, LimitOrder, FilledOrders, OrderDict
 from orderbook.Exchange import Exchange
 from simulation.HistoricalOrderGenerator import HistoricalOrderGenerator
+from utils.clock import NANOSECONDS_PER_SECOND, to_datetime, to_ns
 
 
 class OrderbookSimulator:
@@ -27,36 +27,41 @@ class OrderbookSimulator:
         database: HistoricalDatabase = None,
         outer_levels: int = 5,
         trading_date: datetime = datetime(2012, 6, 21),
-        verbose: bool = False
+        integer_prices: bool = False,
+        verbose: bool = False,
+        quiet: bool = False
     ) -> None:
         self.ticker = ticker
-        self.exchange = exchange or Exchange(ticker)
-        self.order_generator = order_generator or HistoricalOrderGenerator(ticker, database)
-        self.now_is: datetime = datetime(2000, 1, 1)
+        self.exchange = exchange or Exchange(ticker, quiet=quiet)
+        database = database or HistoricalDatabase(ticker, integer_prices)
+        self.order_generator = order_generator or HistoricalOrderGenerator(ticker, database, quiet=quiet)
+        self.now_is: int = to_ns(datetime(2000, 1, 1))  # nanoseconds since epoch
         self.trading_date = trading_date
         self.n_levels = n_levels
-        self.database = database or HistoricalDatabase()
+        self.database = database
         self.outer_levels = outer_levels
         self.verbose = verbose
+        self.quiet = quiet  # the exchange and order generator built here do not warn about missing orders
         # The following is for re-syncronisation with the historical data
         self.max_sell_price: int = 0
         self.min_buy_price: int = np.infty  # type:ignore
         self.initial_buy_price_range: int = np.infty  # type:ignore
         self.initial_sell_price_range: int = np.infty  # type:ignore
 
-    def reset_episode(self, start_date: datetime, start_book: Optional[Orderbook] = None):
+    def reset_episode(self, start_date: int, start_book: Optional[Orderbook] = None):
         if not start_book:
             start_book = self.get_historical_start_book(start_date)
         self.exchange.central_orderbook = start_book
         self._reset_initial_price_ranges()
-        assert start_date.microsecond == 0, "Episodes must be started on the second."
+        assert start_date % NANOSECONDS_PER_SECOND == 0, "Episodes must be started on the second."
         self.now_is = start_date
         return start_book
 
-    def forward_step(self, until: datetime, internal_orders: Optional[List[Order]] = None) -> FilledOrders:
+    def forward_step(self, until: int, internal_orders: Optional[List[Order]] = None) -> FilledOrders:
         assert (
             until > self.now_is
-        ), f"The current time is {self.now_is.time()}, but we are trying to step forward in time until {until.time()}!"
+        ), f"The current time is {to_datetime(self.now_is).time()}, but we are trying to step forward in time until " \
+           f"{to_datetime(until).time()}!"
         external_orders = list(self.order_generator.generate_orders(self.now_is, until))
         orders = internal_orders or list()
         orders += external_orders
@@ -73,9 +78,9 @@ class OrderbookSimulator:
             self.update_outer_levels()
         return FilledOrders(internal=filled_internal_orders, external=filled_external_orders)
 
-    def get_historical_start_book(self, start_date: datetime) -> Orderbook:
+    def get_historical_start_book(self, start_date: int) -> Orderbook:
         start_series = self.database.get_last_snapshot(start_date, ticker=self.ticker)
-        assert len(start_series) > 0, f"There is no data before the episode start time: {start_date}"
+        assert len(start_series) > 0, f"There is no data before the episode start time: {to_datetime(start_date)}"
         initial_orders = self._get_initial_orders_from_snapshot(start_series)
         return self.exchange.get_initial_orderbook_from_orders(initial_orders)
 
@@ -86,11 +91,11 @@ class OrderbookSimulator:
             return False
 
     def update_outer_levels(self) -> None:
-        if self.verbose: print(f"Updating outer levels. Current time is {self.now_is}.")
+        if self.verbose: print(f"Updating outer levels. Current time is {to_datetime(self.now_is)}.")
         orderbook_series = self.database.get_last_snapshot(self.now_is, ticker=self.ticker)
         orders_to_add = self._get_initial_orders_from_snapshot(orderbook_series, self._initial_prices_filter_function)
         for order in orders_to_add:
-            getattr(self.exchange.central_orderbook, order.direction)[order.price] = deque([order])
+            self.exchange.set_level(order)
         self.min_buy_price = min(self.min_buy_price, self.exchange.orderbook_price_range[0])
         self.max_sell_price = max(self.max_sell_price, self.exchange.orderbook_price_range[1])
 
@@ -129,7 +134,7 @@ class OrderbookSimulator:
                 if filter_function(direction, series[f"{direction}_price_{level}"]):
                     initial_orders.append(
                         LimitOrder(
-                            timestamp=series.name,
+                            timestamp=to_ns(series.name),
                             price=series[f"{direction}_price_{level}"],
                             volume=series[f"{direction}_volume_{level}"],
                             direction=direction,  # type: ignore
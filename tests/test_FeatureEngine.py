@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+import numpy as np
+
+from features.FeatureEngine import FeatureEngine
+from features.Features import PriceMove, State
+from utils.clock import NANOSECONDS_PER_MINUTE
+
+
+def get_state(now_is: int, price: float) -> State:
+    return State(None, None, price, None, now_is, None, None)
+
+
+def test_adapter_feeds_owned_price_series():
+    """Features whose price series is not shared by an environment keep their Feature.update values in the engine"""
+    start, prices = 10 * NANOSECONDS_PER_MINUTE, [100.0, 101.0, 103.0, 102.0]
+    reference = PriceMove(update_frequency=timedelta(seconds=1), lookback_periods=1)
+    feature = PriceMove(update_frequency=timedelta(seconds=1), lookback_periods=1)
+    engine = FeatureEngine([[feature]])
+    reference.reset(get_state(start, prices[0]))
+    feature.reset(get_state(start, prices[0]))
+    engine.sync()
+    expected, values = list(), list()
+    for step, price in enumerate(prices[1:], start=1):
+        state = get_state(start + step * 10**9, price)
+        reference.update(state)
+        expected.append(reference.current_value)
+        values.append(engine.update([state])[0, 0])
+    assert expected == [1.0, 2.0, -1.0]
+    np.testing.assert_array_equal(values, expected)
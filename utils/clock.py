@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from typing import Union
+
+# The simulation clock is an int of nanoseconds since the epoch (naive wall-clock time, as in the LOBSTER timestamps),
+# so that time arithmetic in the stepping loop is integer arithmetic. Datetimes are only built for reporting.
+
+NANOSECONDS_PER_MICROSECOND = 1000
+NANOSECONDS_PER_SECOND = 1000000000
+NANOSECONDS_PER_MINUTE = 60 * NANOSECONDS_PER_SECOND
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_ns(time: Union[datetime, timedelta]) -> int:
+    """
+    Convert a datetime (or pandas Timestamp) to nanoseconds since the epoch, or a timedelta to nanoseconds
+    """
+    if hasattr(time, "value"):  # pandas Timestamp / Timedelta already hold nanoseconds
+        return int(time.value)
+    if isinstance(time, datetime):
+        time = time - EPOCH
+    return (time.days * 86400 + time.seconds) * NANOSECONDS_PER_SECOND + time.microseconds * NANOSECONDS_PER_MICROSECOND
+
+
+def to_datetime(ns: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(ns) // NANOSECONDS_PER_MICROSECOND)
+
+
+def to_timedelta(ns: int) -> timedelta:
+    return timedelta(microseconds=int(ns) // NANOSECONDS_PER_MICROSECOND)